@@ -0,0 +1,50 @@
+import os
+import json
+import logging
+
+STATIC_DIR = "static"
+ASSETS_DIR = os.path.join(STATIC_DIR, "dist")
+ASSETS_MANIFEST = os.path.join(ASSETS_DIR, "manifest.json")
+IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".gif", ".webp")
+
+# Resized, content-hashed copies of the files in static/, made by build_assets.py and served from /assets/.
+# The manifest maps the original name (relative to static/) to its copies, anything not built is served from /static/ as it is.
+
+_manifest: dict[str, dict] | None = None
+_listings: dict[str, list[str]] = {}    # folder -> image names, folders are only listed once
+
+def load_manifest() -> dict[str, dict]:
+    """The build manifest, loaded once. Empty if build_assets.py hasn't been run"""
+    global _manifest
+    if _manifest is None:
+        _manifest = {}
+        if os.path.exists(ASSETS_MANIFEST):
+            logging.debug(f"Loading asset manifest from {ASSETS_MANIFEST}")
+            with open(ASSETS_MANIFEST, "r", encoding="utf-8") as f:
+                _manifest = json.load(f)
+    return _manifest
+
+def asset_url(source: str, webp: bool = False) -> str | None:
+    """Absolute url of a static file, e.g. img/banners/september.png -> /assets/img/banners/september.1a2b3c4d5e.jpg.
+       webp asks for the WebP copy instead, None if there isn't one"""
+    built = load_manifest().get(source)
+    if webp:
+        return f"/assets/{built['webp']}" if built and built.get("webp") else None
+    if built is None:
+        return f"/static/{source}"
+    return f"/assets/{built['file']}"
+
+def list_images(folder: str) -> list[str]:
+    """Names (relative to static/) of the images in a folder under static/, e.g. img/icons"""
+    if folder not in _listings:
+        manifest = load_manifest()
+        prefix = folder.rstrip("/") + "/"
+        names = sorted(s for s in manifest if s.startswith(prefix) and "/" not in s[len(prefix):])
+        if not names:
+            # not built, list the folder itself
+            path = os.path.join(STATIC_DIR, folder)
+            if os.path.exists(path):
+                names = sorted(f"{prefix}{f}" for f in os.listdir(path) if f.lower().endswith(IMAGE_EXTS))
+        _listings[folder] = names
+        logging.debug(f"{len(names)} images in {folder}")
+    return _listings[folder]
@@ -0,0 +1,31 @@
+import time
+import logging
+
+class BootTimeline:
+    """
+    How long each step of startup took, from process start to the first frame on screen.
+    Steps are marked as they finish, e.g. config, durations, plan, player, playback, first_frame, webui
+    """
+
+    def __init__(self, started: float | None = None):
+        self.started = started if started is not None else time.perf_counter()
+        self.phases: list[tuple[str, float]] = []   # (step, seconds since start when it finished)
+
+    def mark(self, phase: str):
+        elapsed = time.perf_counter() - self.started
+        previous = self.phases[-1][1] if self.phases else 0.0
+        self.phases.append((phase, elapsed))
+        logging.debug(f"Boot: {phase} done at {elapsed:.3f}s (+{elapsed - previous:.3f}s)")
+
+    def as_dict(self) -> dict:
+        """Each step with when it finished and how long it took, for the web ui"""
+        steps = []
+        previous = 0.0
+        for phase, elapsed in self.phases:
+            steps.append({"phase": phase, "at": round(elapsed, 3), "took": round(elapsed - previous, 3)})
+            previous = elapsed
+        first_frame = next((elapsed for phase, elapsed in self.phases if phase == "first_frame"), None)
+        return {
+            "phases": steps,
+            "time_to_first_frame": round(first_frame, 3) if first_frame is not None else None
+        }
@@ -0,0 +1,121 @@
+import io
+import os
+import json
+import hashlib
+from assets import STATIC_DIR, ASSETS_DIR, ASSETS_MANIFEST, IMAGE_EXTS
+from thumbnails import THUMBS_DIR
+
+try:
+    from PIL import Image   # install package pillow, without it files are only copied (still hashed, so still cached)
+except ImportError:
+    Image = None
+
+# Build step for the web interface, run it after adding or changing anything in static/, e.g. python build_assets.py
+# Images are shrunk to the size the pages show them at and saved as WebP plus a JPEG (PNG if it has transparency),
+# css/js are copied. Every file gets a hash of its contents in its name, so the web interface can tell browsers
+# to cache them forever, a changed file gets a new name.
+
+# largest width, height each folder is shown at (twice the css size, for sharp screens)
+IMAGE_SIZES = {
+    "img/banners": (160, 2800),
+    "img/tvguide": (240, 240),
+    "img/icons": (64, 64),
+}
+DEFAULT_SIZE = (1024, 1024)
+COPY_EXTS = (".css", ".js")
+WEBP_QUALITY = 80
+JPEG_QUALITY = 85
+
+def hashed_name(source: str, data: bytes, ext: str) -> str:
+    """img/banners/september.png + contents -> img/banners/september.1a2b3c4d5e.<ext>"""
+    stem = os.path.splitext(source)[0]
+    digest = hashlib.sha1(data).hexdigest()[:10]
+    return f"{stem}.{digest}{ext}"
+
+def write_asset(name: str, data: bytes):
+    path = os.path.join(ASSETS_DIR, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if not os.path.exists(path):    # same name means same contents
+        with open(path, "wb") as f:
+            f.write(data)
+
+def encode(image, fmt: str, **options) -> bytes:
+    buf = io.BytesIO()
+    image.save(buf, fmt, **options)
+    return buf.getvalue()
+
+def build_image(source: str) -> dict:
+    """Resized WebP and JPEG/PNG copies of one image, returns its manifest entry"""
+    path = os.path.join(STATIC_DIR, source)
+    with open(path, "rb") as f:
+        original = f.read()
+
+    # animated gifs are copied as they are, as is everything without Pillow
+    if Image is None or source.lower().endswith(".gif"):
+        name = hashed_name(source, original, os.path.splitext(source)[1].lower())
+        write_asset(name, original)
+        return {"file": name, "webp": None}
+
+    with Image.open(path) as image:
+        image.load()
+        max_size = IMAGE_SIZES.get(os.path.dirname(source), DEFAULT_SIZE)
+        image.thumbnail(max_size, Image.LANCZOS)   # only ever shrinks, keeps the aspect ratio
+        has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+
+        webp = encode(image, "WEBP", quality=WEBP_QUALITY, method=6)
+        if has_alpha:
+            fallback, ext = encode(image, "PNG", optimize=True), ".png"
+        else:
+            fallback, ext = encode(image.convert("RGB"), "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True), ".jpg"
+        width, height = image.size
+
+    entry = {"file": hashed_name(source, fallback, ext), "webp": hashed_name(source, webp, ".webp"), "width": width, "height": height}
+    write_asset(entry["file"], fallback)
+    write_asset(entry["webp"], webp)
+    print(f"{source}: {len(original) // 1024}KB -> {len(webp) // 1024}KB webp, {len(fallback) // 1024}KB {ext[1:]} ({width}x{height})")
+    return entry
+
+def build_file(source: str) -> dict:
+    """Hashed copy of a css/js file"""
+    with open(os.path.join(STATIC_DIR, source), "rb") as f:
+        data = f.read()
+    name = hashed_name(source, data, os.path.splitext(source)[1])
+    write_asset(name, data)
+    return {"file": name, "webp": None}
+
+# ==========================================================
+# ===================== MAIN ===============================
+# ==========================================================
+def main():
+    if Image is None:
+        print("Pillow was not found (pip install pillow), images will be copied without resizing")
+
+    manifest = {}
+    for root, dirs, files in os.walk(STATIC_DIR):
+        # skip our own output and the guide thumbnails (already small, made by thumbnails.py)
+        dirs[:] = [d for d in dirs if os.path.join(root, d) not in (ASSETS_DIR, THUMBS_DIR)]
+        for f in sorted(files):
+            source = os.path.relpath(os.path.join(root, f), STATIC_DIR).replace(os.sep, "/")
+            if f.lower().endswith(IMAGE_EXTS):
+                manifest[source] = build_image(source)
+            elif f.lower().endswith(COPY_EXTS):
+                manifest[source] = build_file(source)
+
+    # remove copies of files that have since changed or gone
+    wanted = {os.path.normpath(os.path.join(ASSETS_DIR, e[k])) for e in manifest.values() for k in ("file", "webp") if e[k]}
+    for root, _, files in os.walk(ASSETS_DIR):
+        for f in files:
+            path = os.path.normpath(os.path.join(root, f))
+            if path not in wanted and path != os.path.normpath(ASSETS_MANIFEST):
+                os.remove(path)
+
+    os.makedirs(ASSETS_DIR, exist_ok=True)
+    tmp = f"{ASSETS_MANIFEST}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, ASSETS_MANIFEST)
+    print(f"{len(manifest)} assets built into {ASSETS_DIR}")
+# END DEF
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import time
+import logging
+import threading
+import multiprocessing
+from models import Schedule, System, Config
+from boot import BootTimeline
+from snapshot import SNAPSHOT_BIN
+from utils import setup_logging, start_restart_thread, ensure_durations_have_been_calculated, \
+    schedules_from_raw, build_media_index, use_media_index, channel_file, start_fingerprint_thread
+
+# Multi-channel mode, one supervisor runs every channel listed under "channels" in the config.
+# Folders are scanned and durations worked out once by the supervisor, each channel then plays in its own
+# process (own VLC output, planner and trackers) reading the shared media index and durations.json,
+# while the supervisor serves a single web UI for all of them.
+
+def channel_configs(raw: dict) -> dict[str, Config]:
+    """Build a Config per channel, each channel's "system" overrides the top level "system" values"""
+    configs = {}
+    for key, channel_raw in raw["channels"].items():
+        system_raw = dict(raw.get("system", {}))
+        system_raw.setdefault("channel_name", key)
+        system_raw.update(channel_raw.get("system", {}))
+        schedules = {name: Schedule.from_dict(data) for name, data in channel_raw["schedules"].items()}
+        configs[key] = Config(schedules=schedules, system=System.from_dict(system_raw))
+    return configs
+
+def run_channel(key: str, config: Config):
+    """Entry point of a channel process"""
+    from main import play_channel   # imported here, main imports this module
+    logging.debug(f"Channel {key} process started")
+    use_media_index()
+    play_channel(config, key)
+
+def run_supervisor(raw: dict, boot: BootTimeline | None = None):
+    if boot is None:
+        boot = BootTimeline()
+    system = System.from_dict(raw.get("system", {}))
+    setup_logging(system)  # enable logging as per flag in system part of config
+    configs = channel_configs(raw)
+    logging.debug(f"Supervisor starting {len(configs)} channels")
+    boot.mark("config")
+
+    # Scan once for every channel, the duration check then reads the index rather than scanning again
+    schedules = schedules_from_raw(raw)
+    build_media_index(schedules, system.scan_timeout)
+    use_media_index()
+    boot.mark("media_index")
+    ensure_durations_have_been_calculated(schedules, system.peers, system.scan_timeout)
+    boot.mark("durations")
+
+    # Start a process per channel before any threads are started here, so they fork cleanly
+    processes: dict[str, multiprocessing.Process] = {}
+
+    def start(key: str):
+        p = multiprocessing.Process(target=run_channel, args=(key, configs[key]), name=f"channel-{key}", daemon=True)
+        p.start()
+        logging.debug(f"Channel {key} running as pid {p.pid}")
+        processes[key] = p
+
+    for key in configs:
+        start(key)
+    boot.mark("channels")   # each channel logs its own timeline up to its first frame
+
+    web = None  # web UI process, when it runs in its own process
+    thumbs = None   # thumbnail process, made once for every channel
+
+    def stop_all():
+        for key, p in processes.items():
+            logging.debug(f"Stopping channel {key}")
+            p.terminate()
+        if web:
+            web.terminate()
+        if thumbs:
+            thumbs.terminate()
+        for p in processes.values():
+            p.join(timeout=5)
+
+    # spin off background thread that restarts the supervisor (and so every channel) at the specified time
+    start_restart_thread(system, on_restart=stop_all)
+
+    # One web UI for all channels, Flask is only loaded once the channels are on their way.
+    # Each channel writes what it is playing to its own snapshot
+    snapshot_paths = {key: channel_file(SNAPSHOT_BIN, key) for key in configs}
+    if system.webui_process:
+        from webprocess import start_web_process
+        web = start_web_process(snapshot_paths, channels=configs)
+    else:
+        import webui
+        for key, config in configs.items():
+            webui.add_local_channel(key, config)
+            webui.add_snapshot(key, snapshot_paths[key])
+        webui.set_boot_timeline(boot)
+        threading.Thread(target=webui.run_flask, daemon=True).start()
+    boot.mark("webui")
+
+    # fingerprints for peers, in the background now that the channels are on their way
+    start_fingerprint_thread(schedules, system.scan_timeout)
+
+    # guide thumbnails, in the background while the channels are idle
+    if system.thumbnails:
+        from thumbnails import start_thumbnail_process
+        thumbs = start_thumbnail_process()
+
+    # Keep alive, start any channel that falls over again
+    try:
+        while True:
+            time.sleep(5)
+            for key, p in list(processes.items()):
+                if p.is_alive():
+                    continue
+                if p.exitcode == 0:
+                    # finished on its own, e.g. nothing fits before the restart
+                    logging.debug(f"Channel {key} finished")
+                    del processes[key]
+                else:
+                    logging.error(f"Channel {key} stopped with exit code {p.exitcode}, restarting it")
+                    start(key)
+    except KeyboardInterrupt:
+        stop_all()
@@ -0,0 +1,139 @@
+import os
+import mmap
+import array
+import bisect
+import struct
+import logging
+from durationcache import DurationCache, DURATIONS_JSON
+
+DURATIONS_BIN = "durations.bin"
+
+# Compact, read-only copy of durations.json for playback, written after durations are worked out.
+# durations.json keeps every full path as a dict key (plus probe details, fingerprints etc.), on a 1GB Pi with a large
+# library that is a lot of Python objects sitting next to VLC. This file is mmap'd instead, nothing is loaded per file:
+#
+#   header      MAGIC, dir count, file count, string heap size
+#   dirs        per folder: string offset, string length, first file id, file count   (folders are stored once)
+#   files       per file: folder id, name offset, name length    (sorted by folder then name, the index is the file id)
+#   durations   per file: duration in seconds (an array, indexed by file id)
+#   strings     utf-8 folder and file names
+#
+# Lookups find the folder (a small dict built on open) then binary search that folder's file names.
+
+MAGIC = b"NPDUR001"
+HEADER = struct.Struct("=8sIII")
+DIR = struct.Struct("=IIII")
+FILE = struct.Struct("=III")
+
+def write_compact_store(cache: DurationCache, path: str = DURATIONS_BIN):
+    """Write the durations of every file with a duration to the compact store"""
+    logging.debug(f"Writing compact durations to {path}")
+    by_dir: dict[str, list[tuple[str, int]]] = {}
+    for file_path, duration in cache.by_path.items():
+        if duration > 0:
+            folder, name = os.path.split(file_path)
+            by_dir.setdefault(folder, []).append((name, int(duration)))
+
+    strings = bytearray()
+    dirs = bytearray()
+    files = bytearray()
+    durations = array.array("I")
+    for dir_id, folder in enumerate(sorted(by_dir)):
+        encoded = folder.encode("utf-8")
+        dirs += DIR.pack(len(strings), len(encoded), len(durations), len(by_dir[folder]))
+        strings += encoded
+        for name, duration in sorted(by_dir[folder]):
+            encoded = name.encode("utf-8")
+            files += FILE.pack(dir_id, len(strings), len(encoded))
+            strings += encoded
+            durations.append(duration)
+
+    # written to a temp file and swapped in, a running channel may have the old one mapped
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(by_dir), len(durations), len(strings)))
+        f.write(dirs)
+        f.write(files)
+        f.write(durations.tobytes())
+        f.write(strings)
+    os.replace(tmp, path)
+    logging.debug(f"Compact durations written, {len(by_dir)} folders, {len(durations)} files, {len(strings)} bytes of names")
+
+class CompactDurations:
+    """Read-only, memory-mapped durations, looked up by path or by integer file id"""
+
+    def __init__(self, path: str = DURATIONS_BIN):
+        logging.debug(f"Init CompactDurations from {path}")
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.dir_count, self.file_count, strings_size = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a compact durations file")
+
+        self.dirs_offset = HEADER.size
+        self.files_offset = self.dirs_offset + self.dir_count * DIR.size
+        durations_offset = self.files_offset + self.file_count * FILE.size
+        self.strings_offset = durations_offset + self.file_count * 4
+        self.durations = memoryview(self.mm)[durations_offset:self.strings_offset].cast("I")
+
+        # folders are few, so those are the only thing turned into Python objects
+        self.dir_ids: dict[str, int] = {}
+        self.dir_names: list[str] = []
+        for dir_id in range(self.dir_count):
+            name = self._string(*DIR.unpack_from(self.mm, self.dirs_offset + dir_id * DIR.size)[:2])
+            self.dir_ids[name] = dir_id
+            self.dir_names.append(name)
+
+        # corrections made while playing (see PlaylistManager), the file itself is read-only
+        self.overrides: dict[int, int] = {}
+        logging.debug(f"{self.file_count} durations in {self.dir_count} folders mapped")
+
+    def _string(self, offset: int, length: int) -> str:
+        start = self.strings_offset + offset
+        return self.mm[start:start + length].decode("utf-8")
+
+    def _name(self, file_id: int) -> str:
+        _, offset, length = FILE.unpack_from(self.mm, self.files_offset + file_id * FILE.size)
+        return self._string(offset, length)
+
+    def id_of(self, path: str) -> int:
+        """File id of a path, -1 if it has no duration"""
+        folder, name = os.path.split(os.path.abspath(path))
+        dir_id = self.dir_ids.get(folder)
+        if dir_id is None:
+            return -1
+        _, _, first, count = DIR.unpack_from(self.mm, self.dirs_offset + dir_id * DIR.size)
+        i = bisect.bisect_left(range(first, first + count), name, key=self._name)
+        if i < count and self._name(first + i) == name:
+            return first + i
+        return -1
+
+    def path_of(self, file_id: int) -> str:
+        dir_id, _, _ = FILE.unpack_from(self.mm, self.files_offset + file_id * FILE.size)
+        return os.path.join(self.dir_names[dir_id], self._name(file_id))
+
+    def duration_of(self, file_id: int) -> int:
+        return self.overrides.get(file_id, self.durations[file_id])
+
+    def get(self, path: str, default: int = 0) -> int:
+        file_id = self.id_of(path)
+        return self.duration_of(file_id) if file_id >= 0 else default
+
+    def set(self, path: str, duration: int):
+        """Correct a duration for the rest of this run, durations.json must be updated too for it to stick"""
+        file_id = self.id_of(path)
+        if file_id >= 0:
+            self.overrides[file_id] = duration
+
+    def __contains__(self, path: str) -> bool:
+        return self.id_of(path) >= 0
+
+    def __len__(self) -> int:
+        return self.file_count
+
+def ensure_compact_store(path: str = DURATIONS_BIN, cache: DurationCache | None = None):
+    """Rebuild the compact store if durations.json has changed since it was written, from cache if one is already loaded"""
+    if os.path.exists(path) and (not os.path.exists(DURATIONS_JSON) or os.path.getmtime(path) >= os.path.getmtime(DURATIONS_JSON)):
+        logging.debug(f"{path} is up to date")
+        return
+    write_compact_store(cache if cache is not None else DurationCache(), path)
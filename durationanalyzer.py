@@ -1,119 +1,23 @@
-import cv2      # install package opencv-python
 import os       # For file and folder management
 import json
 import math
 from models import *
-from utils import setup_logging
-
-# Class to handle calculating durations of files and writing to a json on disk.
-# As per chat=gpt, 1000 shows would take ~400KB in RAM, so very efficient
-class DurationCache:
-    def __init__(self):
-        logging.debug("Init DurationCache")
-        self.durations_file = "durations.json"
-        self.errors_file = "duration_errors.json"
-        self.by_path = {}
-        self.by_duration = {}
-        self.load()
-
-    def load(self):
-        if os.path.exists(self.durations_file):
-            logging.debug(f"Loading {self.durations_file}")
-            with open(self.durations_file, "r") as f:
-                data = json.load(f)
-                self.by_path = data.get("by_path", {})
-                self.by_duration = data.get("by_duration", {})
-        else:
-            logging.debug(f"Creating new file {self.durations_file}")
-            self.by_path = {}
-            self.by_duration = {}
-            self.save()
-
-    def save(self):
-        logging.debug(f"Saving {self.durations_file}")
-        data = {
-            "by_path": self.by_path,
-            "by_duration": self.by_duration
-        }
-        with open(self.durations_file, "w") as f:
-            json.dump(data, f, indent=2)
-
-    def add(self, path, duration):
-        """Add or update a file duration."""
-        logging.debug(f"Adding/Updating {path}")
-        path = os.path.abspath(path)
-        duration_str = str(round(duration, 2))
-
-        # If the file already exists, remove old duration entry
-        if path in self.by_path:
-            old_duration_str = str(round(self.by_path[path], 2))
-            if old_duration_str in self.by_duration:
-                if path in self.by_duration[old_duration_str]:
-                    self.by_duration[old_duration_str].remove(path)
-                    if not self.by_duration[old_duration_str]:
-                        del self.by_duration[old_duration_str]
-
-        # Add to by_path
-        self.by_path[path] = duration
-
-        # Add to by_duration
-        if duration_str not in self.by_duration:
-            self.by_duration[duration_str] = []
-        if path not in self.by_duration[duration_str]:
-            self.by_duration[duration_str].append(path)
-
-        # Save immediately so file always exists & stays up to date
-        self.save()
-
-
-# Function to get all media files from the current folder
-def get_media_files(folder):
-    logging.debug(f"Begin get media files for folder {folder}")
-    video_exts = ('.mkv', '.mp4', '.avi')
-    media_files = []
-    for root, _, files in os.walk(folder):  # os.walk gets a tuple - "root, dirs, files" '_' discards dirs
-        logging.debug(f"root {root}")
-        for f in files:
-            logging.debug(f"file {f}")
-            if f.lower().endswith(video_exts):
-                logging.debug(f"file {f}, matches {video_exts}, appending")
-                media_files.append(os.path.join(root, f))
-    logging.debug(f"Returning media files coun t{len(media_files)}")
-    return media_files
-
-def log_duration_error(file_path, reason="unknown error", errors_file="duration_errors.json"):
-
-    logging.debug("Begin log_duration_error")
-    # Create empty JSON if not exist or load exsiting from disk
-    if not os.path.exists(errors_file):
-        logging.debug(f"{errors_file} does not exist, we will create")
-        with open(errors_file, "w", encoding="utf-8") as f:
-            json.dump({}, f, indent=2)
-    else:
-        logging.debug(f"{errors_file} does exists, we will load")
-        with open(errors_file, "r") as f:
-            try:
-                errors = json.load(f)
-            except json.JSONDecodeError:
-                errors = {}
-
-    logging.debug(f"Create errors object with file_path {file_path} and reason: {reason}")
-    errors[file_path] = reason  # Create object to write to JSON
-
-    # Write error Json
-    logging.debug("writing object to file")
-    with open(errors_file, "w") as f:
-        json.dump(errors, f, indent=2)
-
-def get_duration_rounded(file_path, errors_file):
+from utils import setup_logging, schedules_from_raw, file_fingerprint, get_media_files_in
+from durationcache import DurationCache, NegativeCache
+
+def probe_media(file_path, failures=None):
+    """Open a file with cv2 and return its duration and video details, None if it can't be read.
+       Failures are recorded in the negative cache if one is given"""
+    import cv2      # install package opencv-python, imported here as it is slow to load and only needed when there is something to probe
     try:
-        logging.debug(f"begin duration calculation for {file_path}")
+        logging.debug(f"begin probe of {file_path}")
         cap = cv2.VideoCapture(file_path)
 
         if not cap.isOpened():
             logging.debug(f"file could not be opened!")
-            log_duration_error(file_path, "could not open file", errors_file)
-            return 0
+            if failures:
+                failures.record(file_path, "could not open file")
+            return None
 
         logging.debug(f"file opened, get fps")
         fps = cap.get(cv2.CAP_PROP_FPS)
@@ -124,16 +28,79 @@ def get_duration_rounded(file_path, errors_file):
         logging.debug(f"get duration")
         duration = frame_count / fps if fps else 0
 
+        logging.debug(f"get resolution and codec")
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        fourcc = int(cap.get(cv2.CAP_PROP_FOURCC))
+        codec = "".join(chr((fourcc >> (8 * i)) & 0xFF) for i in range(4)).strip("\x00 ").lower()
+
         logging.debug(f"release file handle")
         cap.release()
 
-        rounded = math.ceil(duration)
-        logging.debug(f"returning duration '{rounded}'")
-        return rounded
+        # average bitrate in kbps from the file size, close enough to compare against a profile
+        bitrate = int(os.path.getsize(file_path) * 8 / duration / 1000) if duration else 0
+
+        if duration <= 0:
+            logging.debug(f"no duration could be worked out!")
+            if failures:
+                failures.record(file_path, "no duration (frame count or fps missing)")
+            return None
+
+        info = {"duration": duration, "width": width, "height": height, "fps": round(fps, 3), "codec": codec, "bitrate": bitrate}
+        logging.debug(f"returning info '{info}'")
+        return info
 
     except Exception as e:
-        log_duration_error(file_path, str(e), errors_file)
+        if failures:
+            failures.record(file_path, str(e))
+        return None
+
+def get_duration_rounded(file_path, failures=None):
+    info = probe_media(file_path, failures)
+    if info is None:
         return 0
+    rounded = math.ceil(info["duration"])
+    logging.debug(f"returning duration '{rounded}'")
+    return rounded
+
+def analyze(files, cache=None, failures=None):
+    """Work out the duration of every file in files that doesn't have one yet and write them to durations.json.
+       Called in-process by the player at startup (with the cache it already has loaded) or by main() below when run on its own"""
+    if cache is None:
+        cache = DurationCache()     # object to write to duration cache json
+    if failures is None:
+        failures = NegativeCache()  # files that couldn't be probed and when to try them again
+
+    # now loop through all files and begin calculating duration
+    try:
+        for f in files:
+            # files already known (from an earlier run or a peer) are not probed again,
+            # files from before fingerprints were stored just get one so they can be found if moved
+            path = os.path.abspath(f)
+            if cache.by_path.get(path, 0) > 0:
+                logging.debug(f"file: {path} already has a duration, skipping")
+                if path not in cache.fingerprints:
+                    cache.add(path, cache.by_path[path], fingerprint=file_fingerprint(path), save=False)
+                continue
+            # files that failed before are only tried again once their backoff is over
+            if failures.is_backing_off(path):
+                logging.debug(f"file: {path} failed before, next retry {failures.entries[path]['next_retry']}")
+                continue
+            # get duration of file, keep the rest of the probe for the transcoder
+            info = probe_media(path, failures)
+            if info is None:
+                cache.remove(path)  # drop any old zero duration entry, the negative cache has it now
+                continue
+            duration = math.ceil(info["duration"])
+            logging.debug(f"file: {path} is {duration}")
+            failures.clear(path)
+            cache.add(path, duration, info, file_fingerprint(path))
+    finally:
+        # the errors file is written once rather than after every failure
+        failures.save()
+
+    cache.save()
+    logging.debug("file durations calculated successfully")
 
 # ==========================================================
 # ===================== MAIN ===============================
@@ -156,7 +123,7 @@ def main():
         exit(1)
 
     # === Read schedules from rawjson so we know the media paths ===
-    schedules = {name: Schedule.from_dict(data) for name, data in raw["schedules"].items()}
+    schedules = schedules_from_raw(raw)   # includes every channel's schedules in multi-channel mode
     system = System.from_dict(raw["system"])
     config = Config(schedules=schedules, system=system)
     setup_logging(config.system)  # enable logging as per flag in system part of config
@@ -176,22 +143,12 @@ def main():
     # now remove any duplicate paths from the array
     all_media = list(set(all_media))
     logging.debug(f"Dupes removed, '{len(all_media)}' paths remain")
-    cache = DurationCache()     # object to write to duration cache json
-
-    # now loop through all paths and begin calculating duration
-    for dir in all_media:
-        logging.debug(f"Analyzing '{dir}'")
-        # get files in path
-        files_in_path = get_media_files(dir)
-        logging.debug(f"files_in_path count '{len(files_in_path)}'")
-        for f in files_in_path:
-            # get duration of file
-            duration = get_duration_rounded(os.path.join(dir, f), cache.errors_file)  # dir/file
-            logging.debug(f"file: {os.path.join(dir, f)} is {duration}")
-            cache.add(os.path.join(dir, f), duration)
-            cache.save()
-
-    logging.debug("file durations calculated successfully")
+    # folders are scanned all at once, network shares are slow to list
+    all_files = []
+    for files_in_path in get_media_files_in(all_media, system.scan_timeout).values():
+        all_files.extend(files_in_path)
+    logging.debug(f"all_files count '{len(all_files)}'")
+    analyze(all_files)
 # END DEF
 
 if __name__ == "__main__":
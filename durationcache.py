@@ -0,0 +1,213 @@
+import os
+import json
+import hashlib
+import logging
+from datetime import datetime, timedelta
+
+DURATIONS_JSON = "durations.json"
+FINGERPRINT_CHUNK = 64 * 1024     # bytes hashed from the start and end of a file
+
+def file_fingerprint(path: str) -> str | None:
+    """Cheap content fingerprint, the file size plus a hash of its first and last 64KB.
+       Identifies the same file whatever folder or mount it is found under, None if it can't be read"""
+    try:
+        size = os.path.getsize(path)
+        digest = hashlib.sha1()
+        with open(path, "rb") as f:
+            digest.update(f.read(FINGERPRINT_CHUNK))
+            if size > FINGERPRINT_CHUNK * 2:
+                f.seek(-FINGERPRINT_CHUNK, os.SEEK_END)
+                digest.update(f.read(FINGERPRINT_CHUNK))
+        return f"{size}:{digest.hexdigest()[:20]}"
+    except OSError as e:
+        logging.error(f"Could not fingerprint {path}: {e}")
+        return None
+
+# Class to handle calculating durations of files and writing to a json on disk.
+# As per chat=gpt, 1000 shows would take ~400KB in RAM, so very efficient
+class DurationCache:
+    def __init__(self):
+        logging.debug("Init DurationCache")
+        self.durations_file = DURATIONS_JSON
+        self.by_path = {}
+        self.info = {}          # probe details per path (width, height, fps, codec, bitrate), used by the transcoder
+        self.fingerprints = {}  # path -> content fingerprint, lets other nodes match files whatever their path
+        self.versions = {}      # path -> version it was last changed in, so peers can ask for changes only
+        self.version = 0        # bumped on every change
+        self.by_fingerprint = {}  # fingerprint -> path, built on load so moved/renamed files can be matched
+        self.load()
+
+    def load(self):
+        if os.path.exists(self.durations_file):
+            logging.debug(f"Loading {self.durations_file}")
+            with open(self.durations_file, "r") as f:
+                data = json.load(f)
+                self.by_path = data.get("by_path", {})     # older files also held "by_duration", nothing used it so it is dropped
+                self.info = data.get("info", {})
+                self.fingerprints = data.get("fingerprints", {})
+                self.versions = data.get("versions", {})
+                self.version = data.get("version", 0)
+                self.by_fingerprint = {fp: path for path, fp in self.fingerprints.items()}
+        else:
+            logging.debug(f"Creating new file {self.durations_file}")
+            self.by_path = {}
+            self.save()
+
+    def save(self):
+        logging.debug(f"Saving {self.durations_file}")
+        data = {
+            "by_path": self.by_path,
+            "info": self.info,
+            "fingerprints": self.fingerprints,
+            "versions": self.versions,
+            "version": self.version
+        }
+        # written to a temp file and swapped in, a write cut short (e.g. power loss) must never leave a truncated file behind
+        tmp = f"{self.durations_file}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp, self.durations_file)
+
+    def add(self, path, duration, info=None, fingerprint=None, save=True):
+        """Add or update a file duration (and optionally its probe details and fingerprint)."""
+        logging.debug(f"Adding/Updating {path}")
+        path = os.path.abspath(path)
+
+        # Add to by_path
+        self.by_path[path] = duration
+
+        # Add probe details
+        if info:
+            self.info[path] = info
+
+        # Add fingerprint and bump the version so peers pick the change up
+        if fingerprint:
+            self.fingerprints[path] = fingerprint
+            self.by_fingerprint[fingerprint] = path
+        self.version += 1
+        self.versions[path] = self.version
+
+        # Save immediately so file always exists & stays up to date
+        if save:
+            self.save()
+
+    def remove(self, path):
+        """Forget a file, e.g. once it has been found under a new path"""
+        logging.debug(f"Removing {path}")
+        self.by_path.pop(path, None)
+        fingerprint = self.fingerprints.pop(path, None)
+        if fingerprint and self.by_fingerprint.get(fingerprint) == path:
+            del self.by_fingerprint[fingerprint]
+        self.info.pop(path, None)
+        self.versions.pop(path, None)
+
+    def match_relocated(self, missing: list[str]) -> int:
+        """Match files missing a duration against known files by fingerprint, so moved, renamed or
+           re-mounted files keep their duration without being probed. Returns how many were matched"""
+        # the fingerprint starts with the file size, only files of a known size are worth hashing
+        known_sizes = {fp.split(":", 1)[0] for fp in self.by_fingerprint}
+        matched = 0
+        for path in missing:
+            try:
+                if str(os.path.getsize(path)) not in known_sizes:
+                    continue
+            except OSError:
+                continue
+            fingerprint = file_fingerprint(path)
+            old_path = self.by_fingerprint.get(fingerprint)
+            if old_path is None or self.by_path.get(old_path, 0) <= 0:
+                continue
+            logging.debug(f"{path} matches {old_path}, re-using its duration")
+            self.add(path, self.by_path[old_path], self.info.get(old_path), fingerprint, save=False)
+            if not os.path.exists(old_path):
+                self.remove(old_path)   # moved rather than copied
+            matched += 1
+        if matched:
+            self.save()
+        logging.debug(f"{matched} of {len(missing)} missing files matched by fingerprint")
+        return matched
+
+    def backfill_fingerprints(self, paths, save_every: int = 200) -> int:
+        """Fingerprint known files that don't have one yet (durations from before fingerprints were stored),
+           without one they can't be matched when moved or shared with peers. Returns how many were added.
+           Saved every save_every files, so peers can fetch what is done so far while a big library is still going"""
+        added = 0
+        for path in paths:
+            path = os.path.abspath(path)
+            if self.by_path.get(path, 0) <= 0 or path in self.fingerprints:
+                continue
+            fingerprint = file_fingerprint(path)
+            if fingerprint:
+                self.add(path, self.by_path[path], fingerprint=fingerprint, save=False)
+                added += 1
+                if added % save_every == 0:
+                    self.save()
+        if added % save_every:
+            self.save()
+        logging.debug(f"{added} fingerprints backfilled")
+        return added
+
+    def changes_since(self, version: int) -> list[dict]:
+        """Durations changed after version, keyed by fingerprint as paths differ between nodes"""
+        return [
+            {"fingerprint": self.fingerprints[path], "duration": self.by_path[path], "version": v}
+            for path, v in self.versions.items()
+            if v > version and path in self.fingerprints and self.by_path.get(path, 0) > 0
+        ]
+
+
+# Negative cache of files that could not be probed, kept in duration_errors.json.
+# Each failure doubles the wait before the file is tried again (1 hour, 2 hours, ... up to a week),
+# a file that changes on disk (different fingerprint) is tried again straight away.
+class NegativeCache:
+    RETRY_BASE = timedelta(hours=1)
+    RETRY_MAX = timedelta(days=7)
+
+    def __init__(self, errors_file="duration_errors.json"):
+        logging.debug("Init NegativeCache")
+        self.errors_file = errors_file
+        self.entries = {}   # path -> {reason, fingerprint, failures, last_attempt, next_retry}
+        if os.path.exists(self.errors_file):
+            logging.debug(f"Loading {self.errors_file}")
+            try:
+                with open(self.errors_file, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                # older files only held path -> reason, those are simply tried again
+                self.entries = {p: e for p, e in data.items() if isinstance(e, dict)}
+            except json.JSONDecodeError:
+                logging.error(f"{self.errors_file} is not valid json, starting again")
+
+    def save(self):
+        logging.debug(f"Saving {self.errors_file}")
+        with open(self.errors_file, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, indent=2)
+
+    def record(self, path, reason):
+        """Record a failed probe and work out when to try again"""
+        path = os.path.abspath(path)
+        entry = self.entries.get(path, {"failures": 0})
+        failures = entry["failures"] + 1
+        now = datetime.now()
+        wait = min(self.RETRY_BASE * (2 ** (failures - 1)), self.RETRY_MAX)
+        self.entries[path] = {
+            "reason": reason,
+            "fingerprint": file_fingerprint(path),
+            "failures": failures,
+            "last_attempt": now.isoformat(timespec="seconds"),
+            "next_retry": (now + wait).isoformat(timespec="seconds")
+        }
+        logging.debug(f"{path} failed ({reason}), attempt {failures}, next retry in {wait}")
+
+    def clear(self, path):
+        self.entries.pop(os.path.abspath(path), None)
+
+    def is_backing_off(self, path) -> bool:
+        """True if the file failed before and isn't due another try yet"""
+        entry = self.entries.get(os.path.abspath(path))
+        if entry is None:
+            return False
+        if datetime.fromisoformat(entry["next_retry"]) <= datetime.now():
+            return False
+        # replaced with a different file, worth trying now
+        fingerprint = file_fingerprint(path)
+        return fingerprint is None or fingerprint == entry["fingerprint"]
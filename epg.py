@@ -0,0 +1,197 @@
+import os
+import json
+import bisect
+import hashlib
+import logging
+import random
+import threading
+import dataclasses
+from datetime import datetime, date, timedelta
+from models import Config, PlanEntry, Category
+from planner import QueuePlanner
+
+GUIDE_DIR = "guide"
+GUIDE_FORMAT_VERSION = 1
+
+class GuideNotPlanned(Exception):
+    """A read-only guide was asked for a day the player hasn't planned (yet)"""
+
+class GuideStore:
+    """
+    Rolling multi-day electronic programme guide (EPG).
+    Each day is planned from midnight to midnight with an rng seeded from (seed, channel, date),
+    so the same config and seed always give the same guide. Days are written to their own file
+    under guide/ as a list of entries sorted by start time, range queries only open the days they
+    touch and use bisect on the start times to find the matching entries.
+    Without a planner the store is read-only, it only reads the days the player's own store wrote (e.g. in the web UI process),
+    planning them separately could give a different lineup (the player's planner knows about unhealthy files etc.)
+    """
+
+    def __init__(self, config: Config, planner: QueuePlanner | None, seed: int, days: int = 7, directory: str = GUIDE_DIR):
+        logging.debug(f"Init GuideStore in {directory} for {days} days")
+        self.config = config
+        self.planner = planner
+        self.seed = seed
+        self.days = max(1, days)
+        self.directory = directory
+        self.channel_name = config.system.channel_name
+        self.config_hash = self._hash_config()
+        self.loaded: dict[date, dict] = {}  # in-memory cache of day files we have already read
+        self.lock = threading.Lock()        # web requests and the precompute thread share the cache
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _hash_config(self) -> str:
+        """Hash of the schedules + seed, if either changes the stored days are planned again"""
+        raw = {name: dataclasses.asdict(s) for name, s in self.config.schedules.items()}
+        text = json.dumps({"schedules": raw, "seed": self.seed, "channel": self.channel_name}, sort_keys=True)
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def _day_path(self, day: date) -> str:
+        return os.path.join(self.directory, f"{day.isoformat()}.json")
+
+    def window(self) -> tuple[date, date]:
+        """First and last day kept on disk, yesterday (for entries running past midnight) to the last precomputed day"""
+        today = date.today()
+        return today - timedelta(days=1), today + timedelta(days=self.days - 1)
+
+    def _plan_day(self, day: date, persist: bool = True) -> dict:
+        """Plan a single day and write it to disk (unless persist is off)"""
+        logging.debug(f"Planning guide day {day}")
+        rng = random.Random(f"{self.seed}:{self.channel_name}:{day.isoformat()}")
+        plan = self.planner.plan_day(day, rng)
+
+        entries = []
+        for e in plan:
+            path = self.planner.durations.path_of(e.media_id)
+            entries.append({
+                "start": int(e.start.timestamp()),
+                "duration": e.duration,
+                "path": path,
+                "title": os.path.splitext(os.path.basename(path))[0],
+                "category": e.category.label
+            })
+
+        data = {
+            "version": GUIDE_FORMAT_VERSION,
+            "date": day.isoformat(),
+            "channel_name": self.channel_name,
+            "config_hash": self.config_hash,
+            "max_duration": max((e["duration"] for e in entries), default=0),  # how far back a range query must look
+            "entries": entries
+        }
+
+        if not persist:
+            return data
+
+        # write to a temp file first so a reader never sees a half written day
+        path = self._day_path(day)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+        logging.debug(f"Guide day {day} written with {len(entries)} entries")
+        return data
+
+    def get_day(self, day: date) -> dict:
+        """Return the guide for a day, reading it from disk or planning it if it doesn't exist yet.
+           A read-only store raises GuideNotPlanned instead of planning"""
+        with self.lock:
+            if day in self.loaded:
+                return self.loaded[day]
+
+            # days outside the rolling window are planned on the fly but never kept, so odd queries can't fill the disk
+            first, last = self.window()
+            if not first <= day <= last:
+                if self.planner is None:
+                    raise GuideNotPlanned(f"{day} is outside the guide window {first} - {last}")
+                logging.debug(f"Guide day {day} is outside the window, planning it without keeping it")
+                return self._plan_day(day, persist=False)
+
+            data = None
+            path = self._day_path(day)
+            if os.path.exists(path):
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        data = json.load(f)
+                except (OSError, json.JSONDecodeError) as e:
+                    logging.error(f"Failed to read guide day {path}: {e}")
+                    data = None
+
+            if data is None or data.get("version") != GUIDE_FORMAT_VERSION or data.get("config_hash") != self.config_hash:
+                if self.planner is None:
+                    raise GuideNotPlanned(f"guide for {day} has not been planned yet")
+                logging.debug(f"Guide day {day} missing or stale, planning it")
+                data = self._plan_day(day)
+
+            # only keep the rolling window (yesterday plus the precomputed days) in memory
+            if len(self.loaded) >= self.days + 1:
+                self.loaded.pop(min(self.loaded))
+            self.loaded[day] = data
+            return data
+
+    def query(self, start: datetime, end: datetime) -> list[dict]:
+        """Return guide entries that overlap start..end, sorted by start time"""
+        logging.debug(f"Guide query {start} - {end}")
+        lo, hi = int(start.timestamp()), int(end.timestamp())
+        results = []
+
+        # an entry that starts the day before could still be running at 'start', unless that day is no longer kept
+        day = max(start.date() - timedelta(days=1), min(start.date(), self.window()[0]))
+        while day <= end.date():
+            data = self.get_day(day)
+            entries = data["entries"]
+            # skip everything that ended before the window, then walk until we pass the end
+            first = bisect.bisect_left(entries, lo - data["max_duration"], key=lambda e: e["start"])
+            for e in entries[first:]:
+                if e["start"] >= hi:
+                    break
+                if e["start"] + e["duration"] > lo:
+                    results.append(e)
+            day += timedelta(days=1)
+
+        return results
+
+    def plan_between(self, start: datetime, end: datetime) -> list[PlanEntry]:
+        """Return the guide between start and end as a playlist, dropping any overlap at day boundaries"""
+        playlist: list[PlanEntry] = []
+        last_end = 0
+        durations = self.planner.durations
+        for e in self.query(start, end):
+            if e["start"] < last_end:
+                logging.debug(f"Dropping {e['path']}, it overlaps the previous day")
+                continue
+            media_id = durations.id_of(e["path"])
+            if media_id < 0:
+                logging.debug(f"Dropping {e['path']}, it no longer has a duration")
+                continue
+            playlist.append(PlanEntry(media_id, Category[e["category"].upper()], datetime.fromtimestamp(e["start"]),
+                                      e["duration"], self.planner.proxy_by_id.get(media_id)))
+            last_end = e["start"] + e["duration"]
+        return playlist
+
+    def precompute(self):
+        """Make sure the rolling window of days exists on disk and remove days that have passed"""
+        today = date.today()
+        logging.debug(f"Precomputing guide from {today} for {self.days} days")
+        for offset in range(self.days):
+            self.get_day(today + timedelta(days=offset))
+
+        # yesterday is kept as entries running past midnight are still needed, days past the window are from older configs
+        oldest, newest = self.window()
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                day = date.fromisoformat(name[:-len(".json")])
+            except ValueError:
+                continue
+            if day < oldest or day > newest:
+                logging.debug(f"Removing old guide day {name}")
+                os.remove(os.path.join(self.directory, name))
+
+    def start_precompute_thread(self):
+        """Precompute the guide in the background so startup isn't held up"""
+        logging.debug("start guide precompute thread")
+        t = threading.Thread(target=self.precompute, daemon=True)
+        t.start()
+        return t
@@ -0,0 +1,58 @@
+import os
+import json
+import logging
+import threading
+from datetime import datetime
+
+HEALTH_JSON = "health.json"
+
+class HealthIndex:
+    """
+    Per-file playback health, built from libVLC's decode stats.
+    For each file we keep how many pictures were displayed and lost over all plays,
+    files that lose more than max_loss_ratio of their pictures can't be decoded in real time on this hardware.
+    """
+
+    def __init__(self, path: str = HEALTH_JSON, max_loss_ratio: float = 0.05):
+        logging.debug(f"Init HealthIndex with path {path}")
+        self.path = path
+        self.max_loss_ratio = max_loss_ratio
+        self.lock = threading.Lock()
+        self.data: dict[str, dict] = {}
+        if os.path.exists(self.path):
+            logging.debug(f"path exists, loading from {self.path}")
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self.data = json.load(f)
+            except json.JSONDecodeError as e:
+                logging.error(f"Failed to load {self.path}: {e}")
+
+    def save(self):
+        logging.debug(f"Saving data to {self.path}")
+        with self.lock:
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.data, f, indent=2)
+            os.replace(tmp, self.path)
+
+    def record(self, filepath: str, displayed: int, lost: int, max_bitrate: float):
+        """Add the stats from one play of a file"""
+        logging.debug(f"Recording health of {filepath}: displayed {displayed}, lost {lost}, bitrate {max_bitrate}")
+        with self.lock:
+            entry = self.data.setdefault(filepath, {"plays": 0, "displayed": 0, "lost": 0, "max_bitrate": 0.0})
+            entry["plays"] += 1
+            entry["displayed"] += displayed
+            entry["lost"] += lost
+            entry["max_bitrate"] = max(entry["max_bitrate"], max_bitrate)
+            total = entry["displayed"] + entry["lost"]
+            entry["loss_ratio"] = round(entry["lost"] / total, 4) if total else 0.0
+            entry["last_played"] = datetime.now().isoformat(timespec="seconds")
+        self.save()
+
+    def is_unhealthy(self, filepath: str) -> bool:
+        """True if the file has been seen dropping too many pictures"""
+        entry = self.data.get(filepath)
+        return entry is not None and entry.get("loss_ratio", 0.0) > self.max_loss_ratio
+
+    def unhealthy_files(self) -> list[str]:
+        return [p for p in self.data if self.is_unhealthy(p)]
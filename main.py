@@ -1,20 +1,33 @@
+import time
+BOOT_STARTED = time.perf_counter()     # taken before anything else is imported, so the boot timeline includes imports
+
+import os
+import json
 import logging
+import pathlib
+import random
+import threading
+from datetime import datetime, timedelta
 from models import Schedule, Config, System
-from tracker import PlayedTracker, QueuedTracker
+from tracker import PlayedTracker, QueuedTracker, QUEUED_JSON_PATH
 from planner import QueuePlanner
 from player import PlaylistManager
-from utils import *
-from datetime import datetime
-from utils import setup_logging
-from webui import *
-
-DURATIONS_JSON = "durations.json"
-DURATIONS_SCRIPT = "durationanalyzer.py"
+from health import HealthIndex, HEALTH_JSON
+from compactdurations import CompactDurations
+from boot import BootTimeline
+from snapshot import SNAPSHOT_BIN, start_snapshot_thread
+from utils import setup_logging, start_restart_thread, ensure_durations_have_been_calculated, channel_file, \
+    seconds_until_restart, save_duration_correction, stop_child_processes, build_media_index, use_media_index, \
+    start_fingerprint_thread
+# Flask (webui), requests, the guide and the multi-channel supervisor are imported where they are used,
+# none of them are needed to get the first picture on screen
 
 # Pick the config file by OS
 CONFIG_FILE_NAME = "config_pi.json" if os.name != "nt" else "config_nt.json"
 
 def main():
+    boot = BootTimeline(BOOT_STARTED)
+    boot.mark("imports")
 
     # Load config
     if not os.path.exists(CONFIG_FILE_NAME):
@@ -23,48 +36,144 @@ def main():
     with open(CONFIG_FILE_NAME, "r") as f:
         raw  = json.load(f)
 
+    # Several channels in one config are run by the supervisor instead
+    if "channels" in raw:
+        from channels import run_supervisor
+        run_supervisor(raw, boot)
+        return
+
     # Build objects and setup logging
     schedules = {name: Schedule.from_dict(data) for name, data in raw["schedules"].items()}
     system = System.from_dict(raw["system"])
     config = Config(schedules=schedules, system=system)
     setup_logging(config.system)  # enable logging as per flag in system part of config
     logging.debug("Initialization complete")
+    boot.mark("config")
 
-    # spin off background thread that restarts script at specified time
-    start_restart_thread(system)
+    # spin off background thread that restarts script at specified time, the web UI process (if any) is stopped first
+    start_restart_thread(system, on_restart=stop_child_processes)
 
-    # Start Flask in a background thread
-    flask_thread = threading.Thread(target=run_flask, daemon=True)
-    flask_thread.start()
+    # Scan the folders once, the duration check and the planner's pools (and refills) then read the index rather than scanning again
+    build_media_index(schedules, system.scan_timeout)
+    use_media_index()
+    boot.mark("media_index")
 
     # Call method to ensure durations for all files have been calculated, if not they will be re-calculated
-    ensure_durations_have_been_calculated(schedules)
+    ensure_durations_have_been_calculated(schedules, system.peers, system.scan_timeout)
+    boot.mark("durations")
 
-    # Now onto the main work - read durations json but this time not just by_path, json will always exist, we made sure in above method
-    with open(DURATIONS_JSON, "r", encoding="utf-8") as f:
-        durations_json = json.load(f)
+    play_channel(config, boot=boot, serve_web=True)
+
+def play_channel(config: Config, channel: str = "", boot: BootTimeline | None = None, serve_web: bool = False):
+    """Plan and play a single channel until the process ends.
+       channel is empty for a single channel setup, otherwise it keeps this channels files apart from the others.
+       serve_web starts the web UI once playback has started (in multi-channel mode the supervisor serves it instead).
+       Now playing, metrics and the boot timeline are written to a snapshot for a web UI in another process"""
+    system = config.system
+    if boot is None:
+        boot = BootTimeline()
+
+    # Now onto the main work - map the compact durations store, it will always exist, we made sure before calling
+    durations = CompactDurations()
 
     # construct objects
-    tracker         = PlayedTracker() # Track played items
-    queued_tracker  = QueuedTracker(config) # Track queued items
-    planner         = QueuePlanner(config, tracker, queued_tracker, durations_json, system) # plans the queue of shows/ads/bumpers
+    tracker         = PlayedTracker(channel_file("played.json", channel)) # Track played items
+    queued_tracker  = QueuedTracker(config, channel_file(QUEUED_JSON_PATH, channel)) # Track queued items
+    health          = HealthIndex(channel_file(HEALTH_JSON, channel), system.health_max_loss) if system.health_policy != "off" else None # Track decode health
+    planner         = QueuePlanner(config, tracker, queued_tracker, durations, system, health) # plans the queue of shows/ads/bumpers
+
+    # build the playlist, in guide mode playback follows the seeded guide so what is listed is what airs
+    boot.mark("trackers")
+    now = datetime.now()
+    restart_at = now + timedelta(seconds=seconds_until_restart(system))
+    guide = None
+    if system.guide_seed is not None:
+        logging.debug(f"Guide mode enabled with seed {system.guide_seed}")
+        from epg import GuideStore, GUIDE_DIR
+        guide = GuideStore(config, planner, system.guide_seed, system.guide_days, os.path.join(GUIDE_DIR, channel))
 
-    # build the playlist
-    plan = planner.build_playlist_until_restart(datetime.now())
+        def plan_from(start_time, aired=None):
+            # the guide is the same whatever has aired
+            guide_plan = guide.plan_between(start_time, restart_at)
+            for entry in guide_plan:
+                path = durations.path_of(entry.media_id)
+                queued_tracker.mark_queued(pathlib.Path(path).stem, entry.category.label, entry.start, path)
+            return guide_plan
+
+        plan = plan_from(now)
+    else:
+        def plan_from(start_time, aired=None):
+            return planner.build_playlist(start_time, int((restart_at - start_time).total_seconds()), random.Random(), exclude=aired)
+
+        plan = planner.build_playlist_until_restart(now)
     if not plan:
         print("[INFO] Nothing fits before restart. Exiting.")
         return
+    boot.mark("plan")
 
     # Create VLC manager, add planned items with categories
-    manager = PlaylistManager(config, tracker)
-    for file_path, category in plan:
-        manager.add_to_playlist(file_path, category)
+    manager = PlaylistManager(config, tracker, durations, health)
+    for entry in plan:
+        # the first guide entry may already be running, join it part way through
+        offset = max(0, int((now - entry.start).total_seconds()))
+        manager.add_to_playlist(entry, start_offset=offset)
+    boot.mark("player")
+
+    # When playback drifts too far from the plan the rest of the day is re-planned from where playback really is
+    # Shows and ads that have aired (or are airing) since startup aren't picked again by the new plan
+    def replan(start_time):
+        queued_tracker.clear_from(start_time)
+        aired = {entry.media_id for entry in manager.entries[:manager.current_index + 1]}
+        return plan_from(start_time, aired)
+
+    # When an item plays for longer/shorter than its stored duration, fix the duration for next time
+    def correct_duration(path, seconds):
+        durations.set(path, seconds)
+        save_duration_correction(path, seconds, channel)
+
+    manager.replanner = replan
+    manager.on_duration_corrected = correct_duration
+    manager.on_first_frame = lambda: boot.mark("first_frame")
 
     # Start playback & go fullscreen
     manager.start_playback()
+    boot.mark("playback")
     time.sleep(1)
     manager.set_fullscreen(True)
 
+    # the web UI reads these from a snapshot when it runs in another process (its own, or the supervisor in multi-channel mode)
+    if channel or system.webui_process:
+        start_snapshot_thread(channel_file(SNAPSHOT_BIN, channel), lambda: {
+            "channel_name": system.channel_name,
+            "updated": datetime.now().isoformat(timespec="seconds"),
+            "now_playing": manager.now_playing(),
+            "metrics": manager.get_metrics(),
+            "boot": boot.as_dict()
+        })
+
+    # Only now that something is on screen start the rest, the guide's background planning, thumbnails and the web UI
+    if guide:
+        guide.start_precompute_thread()
+    if serve_web:
+        # in multi-channel mode the supervisor does this once for every channel
+        start_fingerprint_thread(config.schedules, system.scan_timeout)
+    if serve_web and system.thumbnails:
+        # in multi-channel mode the supervisor makes them once for every channel
+        from thumbnails import start_thumbnail_process
+        start_thumbnail_process()
+    if serve_web and system.webui_process:
+        from webprocess import start_web_process
+        start_web_process({"": SNAPSHOT_BIN}, guide_config=config if guide else None)
+        boot.mark("webui")
+    elif serve_web:
+        import webui
+        if guide:
+            webui.set_guide_store(guide)
+        webui.set_player(manager)
+        webui.set_boot_timeline(boot)
+        threading.Thread(target=webui.run_flask, daemon=True).start()
+        boot.mark("webui")
+
     # Keep alive so VLC events fire
     try:
         while True:
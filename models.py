@@ -1,4 +1,5 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from enum import IntEnum
 from typing import List, Dict
 from datetime import datetime
 import logging
@@ -72,6 +73,23 @@ class System:
     bumper_chance: float
     channel_name: str
     create_debug_file: bool = False  # default = off
+    guide_seed: int | None = None    # set to enable the seeded multi-day guide, None = off
+    guide_days: int = 7              # number of days the guide precomputes ahead
+    prefetch_items: int = 2          # number of upcoming files to warm in the page cache, 0 = off
+    prefetch_mb: int = 64            # total MB read ahead from the upcoming files
+    drift_threshold: int = 30        # seconds playback can drift from the plan before re-planning
+    health_policy: str = "deprioritize"  # files that drop frames: "deprioritize", "skip" or "off"
+    health_max_loss: float = 0.05    # fraction of lost pictures before a file is unhealthy
+    transcode_codecs: List[str] = field(default_factory=lambda: ["avc1", "h264", "x264"])  # codecs the Pi plays as they are
+    transcode_max_height: int = 720  # files taller than this get a proxy
+    transcode_max_bitrate: int = 4000  # kbps, files above this get a proxy
+    transcode_proxy_dir: str = "proxies"  # where transcoder.py writes proxies
+    transcode_workers: int = 1       # ffmpeg processes run at once
+    vlc_args: List[str] = field(default_factory=list)  # extra VLC arguments, e.g. the audio/video output of a channel
+    peers: List[dict] = field(default_factory=list)     # other NostalgiaPis, {"name": ..., "url": ".../queued"}
+    webui_process: bool = False      # run the web UI in its own low priority process instead of a thread next to playback
+    thumbnails: bool = True          # make guide thumbnails of each file in the background while the Pi is idle
+    scan_timeout: int = 30           # seconds a media folder may take to list before it is reported unreachable
 
     @staticmethod
     def from_dict(data: dict) -> "System":
@@ -81,9 +99,47 @@ class System:
             minute=data.get("minute", 0),           # default to 0 if missing
             bumper_chance = float(data.get("bumper_chance", 0.5)), # default to 50% chance
             create_debug_file = bool(data.get("create_debug_file", False)), # determines if debug log will be used
-            channel_name = data.get("channel_name", "NostalgiaPi")  # Name of Channel
+            channel_name = data.get("channel_name", "NostalgiaPi"),  # Name of Channel
+            guide_seed = data.get("guide_seed"),            # seed for the guide, missing = guide mode off
+            guide_days = int(data.get("guide_days", 7)),    # days of guide to precompute
+            prefetch_items = int(data.get("prefetch_items", 2)),  # upcoming files to read ahead
+            prefetch_mb = int(data.get("prefetch_mb", 64)),  # MB budget for read ahead
+            drift_threshold = int(data.get("drift_threshold", 30)),  # seconds of drift allowed before re-plan
+            health_policy = data.get("health_policy", "deprioritize"),  # what the planner does with files that drop frames
+            health_max_loss = float(data.get("health_max_loss", 0.05)),  # lost picture ratio before a file is unhealthy
+            transcode_codecs = [c.lower() for c in data.get("transcode_codecs", ["avc1", "h264", "x264"])],  # codecs that don't need a proxy
+            transcode_max_height = int(data.get("transcode_max_height", 720)),  # max height before a proxy is made
+            transcode_max_bitrate = int(data.get("transcode_max_bitrate", 4000)),  # max kbps before a proxy is made
+            transcode_proxy_dir = data.get("transcode_proxy_dir", "proxies"),  # proxy output folder
+            transcode_workers = int(data.get("transcode_workers", 1)),  # parallel ffmpeg processes
+            vlc_args = list(data.get("vlc_args", [])),  # passed to vlc.Instance
+            peers = list(data.get("peers", [])),  # other nodes, used for the schedule viewer and duration sync
+            webui_process = bool(data.get("webui_process", False)),  # web UI in a separate niced process
+            thumbnails = bool(data.get("thumbnails", True)),  # background guide thumbnails
+            scan_timeout = int(data.get("scan_timeout", 30))  # seconds per media folder, raise for large network shares
         )
 
+# Category of a media file, stored as a small int in plans
+class Category(IntEnum):
+    SHOWS = 0
+    ADS = 1
+    BUMPERS = 2
+
+    @property
+    def label(self) -> str:
+        """Name used in the config, played.json, queued.json and the guide, e.g. shows"""
+        return self.name.lower()
+
+# A single planned item, what the planner hands to the player and the guide.
+# Media is referenced by its id in the compact durations store, the path is only looked up when needed
+@dataclass(slots=True)
+class PlanEntry:
+    media_id: int       # file id in durations.bin
+    category: Category  # shows, ads or bumpers
+    start: datetime     # planned start time
+    duration: int       # planned duration in seconds
+    play_path: str | None = None    # Pi friendly proxy to play instead, None = play the file itself
+
 # Class representing the config file
 @dataclass
 class Config:
@@ -93,8 +149,14 @@ class Config:
 
     def get_active_schedule_at(self, when: datetime) -> Schedule | None:
         logging.debug(f"Begin get_active_schedule_at")
+        name = self.get_active_schedule_name_at(when)
+        return self.schedules[name] if name is not None else None
+
+    def get_active_schedule_name_at(self, when: datetime) -> str | None:
+        """Return the name (dict key) of the active schedule, saves searching for it by object afterwards"""
+        logging.debug(f"Begin get_active_schedule_name_at")
         active = [
-            s for s in self.schedules.values()
+            (n, s) for n, s in self.schedules.items()
             if s.is_active(
                 hour=when.hour,
                 weekday=(when.weekday() + 1),  # datetime: 0=Mon..6=Sun, we use 1-7 as 0 is any day
@@ -107,5 +169,5 @@ class Config:
             return None
 
         # Return the top entry from the list of schedules sorted by priority (1 is highest)
-        return sorted(active, key=lambda s: s.priority)[0]
+        return sorted(active, key=lambda ns: ns[1].priority)[0][0]
 
@@ -0,0 +1,83 @@
+import os
+import json
+import logging
+import urllib.parse
+import requests
+from durationcache import DurationCache
+from utils import file_fingerprint
+
+PEER_DURATIONS_JSON = "peer_durations.json"
+
+# Pulls durations already worked out by other NostalgiaPi nodes (system.peers) so a new node
+# sharing the same library doesn't have to probe every file itself.
+# Peers are asked for changes since the last version we saw, files are matched by fingerprint as paths differ between nodes.
+
+def peer_base_url(peer: dict) -> str:
+    """Peers are listed by their /queued url, the web ui root is the same host and port"""
+    if "base_url" in peer:
+        return peer["base_url"].rstrip("/")
+    parts = urllib.parse.urlsplit(peer["url"])
+    return f"{parts.scheme}://{parts.netloc}"
+
+def pull_peer_durations(peers: list[dict]) -> dict[str, int]:
+    """Fetch new durations from every peer, returns fingerprint -> duration for everything known so far"""
+    state = {}
+    if os.path.exists(PEER_DURATIONS_JSON):
+        try:
+            with open(PEER_DURATIONS_JSON, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            # e.g. cut short by a power loss before writes were atomic, everything is just fetched again
+            logging.error(f"Failed to load {PEER_DURATIONS_JSON}, starting again: {e}")
+            state = {}
+
+    for peer in peers:
+        base = peer_base_url(peer)
+        known = state.setdefault(base, {"version": 0, "durations": {}})
+        try:
+            logging.debug(f"Asking {base} for durations since version {known['version']}")
+            r = requests.get(f"{base}/durations", params={"since": known["version"]}, timeout=5)
+            r.raise_for_status()
+            data = r.json()
+            if data["version"] < known["version"]:
+                # the peer started its durations again, so start again from scratch
+                logging.debug(f"{base} version went backwards, fetching everything")
+                r = requests.get(f"{base}/durations", params={"since": 0}, timeout=5)
+                r.raise_for_status()
+                data = r.json()
+                known["durations"] = {}
+            for entry in data["entries"]:
+                known["durations"][entry["fingerprint"]] = entry["duration"]
+            known["version"] = data["version"]
+            logging.debug(f"{base} returned {len(data['entries'])} changed durations")
+        except Exception as ex:
+            logging.error(f"Could not get durations from {base}: {ex}")
+
+    # written to a temp file and swapped in, a write cut short must never leave a truncated file behind
+    tmp = f"{PEER_DURATIONS_JSON}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp, PEER_DURATIONS_JSON)
+
+    merged = {}
+    for known in state.values():
+        merged.update(known["durations"])
+    return merged
+
+def sync_peer_durations(peers: list[dict], missing: list[str], cache: DurationCache) -> int:
+    """Fill in durations of missing files from peers, returns how many were found"""
+    known = pull_peer_durations(peers)
+    if not known:
+        return 0
+
+    matched = 0
+    for path in missing:
+        fingerprint = file_fingerprint(path)
+        if fingerprint and fingerprint in known:
+            logging.debug(f"Duration of {path} found on a peer")
+            cache.add(path, known[fingerprint], fingerprint=fingerprint, save=False)
+            matched += 1
+    if matched:
+        cache.save()
+    logging.debug(f"{matched} of {len(missing)} missing durations found on peers")
+    return matched
@@ -1,98 +1,147 @@
+import array
 import logging
 import random
-from datetime import datetime, timedelta
-from models import Config, System
+from datetime import datetime, date, timedelta
+from models import Config, System, PlanEntry, Category
 from tracker import PlayedTracker, QueuedTracker
-from utils import get_media_files, seconds_until_restart
+from health import HealthIndex
+from compactdurations import CompactDurations
+from utils import get_media_files_in, seconds_until_restart, load_proxies
 import pathlib
 
 class QueuePlanner:
     """
     Builds a play queue from 'now' until the configured restart time,
     honoring active schedule at each point in time and using durations
-    from durations["by_path"].
+    from the compact durations store (durations.bin).
     """
 
-    def __init__(self, config: Config, tracker: PlayedTracker, queue_tracker: QueuedTracker, durations: dict, system: System):
+    def __init__(self, config: Config, tracker: PlayedTracker, queue_tracker: QueuedTracker, durations: CompactDurations, system: System, health: HealthIndex | None = None):
         logging.debug(f"Init QueuePlanner")
         self.config = config
         self.tracker = tracker
         self.queue_tracker = queue_tracker
         self.durations = durations
         self.system = system
-
-    def build_playlist_until_restart(self, start_time: datetime) -> list[tuple[str, str]]:
+        self.health = health
+        self.proxies = load_proxies()   # original path -> Pi friendly proxy made by transcoder.py
+        logging.debug(f"{len(self.proxies)} proxies available")
+
+        # pools hold media ids, so look up proxies and unhealthy files by id once here rather than on every pick
+        self.proxy_by_id = {durations.id_of(src): proxy for src, proxy in self.proxies.items() if src in durations}
+        self.unhealthy_ids: set[int] = set()
+        if health and system.health_policy != "off":
+            for path in health.unhealthy_files():
+                logging.warning(f"{path} drops frames on this hardware, policy is '{system.health_policy}'")
+                media_id = durations.id_of(path)
+                if media_id >= 0 and media_id not in self.proxy_by_id:   # fine once it has a proxy to play instead
+                    self.unhealthy_ids.add(media_id)
+
+    def _entry(self, media_id: int, category: Category, start: datetime, duration: int) -> PlanEntry:
+        """Make a plan entry, playing the proxy of the file if there is one"""
+        return PlanEntry(media_id, category, start, duration, self.proxy_by_id.get(media_id))
+
+    def _media_ids(self, folders: list[str]) -> array.array:
+        """Ids of all media in the folders, sorted so a seeded rng always sees the pools in the same order"""
+        ids = array.array("I")
+        for files in get_media_files_in(folders, self.system.scan_timeout).values():
+            for path in files:
+                # files without a duration (new, or failed to probe and waiting for a retry) aren't in the store and can never be picked
+                media_id = self.durations.id_of(path)
+                if media_id >= 0:
+                    ids.append(media_id)
+        ids = array.array("I", sorted(set(ids)))
+        if self.system.health_policy == "skip" and self.unhealthy_ids:
+            ids = array.array("I", (i for i in ids if i not in self.unhealthy_ids))
+        return ids
+
+    def _shuffled(self, ids: array.array, rng: random.Random) -> list[int]:
+        """Shuffle a pool, files that can't decode in real time go to the back when deprioritized"""
+        shuffled = list(ids)
+        rng.shuffle(shuffled)
+        if self.system.health_policy == "deprioritize" and self.unhealthy_ids:
+            shuffled.sort(key=self.unhealthy_ids.__contains__)    # stable sort keeps the shuffle within each group
+        return shuffled
+
+    def build_playlist_until_restart(self, start_time: datetime) -> list[PlanEntry]:
         """Builds a playlist that runs from now until the reboot time specified.
            Takes into account the active schedule at each point in time."""
         logging.debug(f"Begin build_playlist_until_restart")
-        playlist: list[tuple[str, str]] = []
-        current_time = start_time
-        logging.debug(f"Current time: {current_time}")
         secs_left = seconds_until_restart(self.system)
         logging.debug(f"Secs left: {secs_left}")
+        return self.build_playlist(start_time, secs_left, random.Random(), track=True)
+
+    def plan_day(self, day: date, rng: random.Random) -> list[PlanEntry]:
+        """Plans a whole day (midnight to midnight) for the guide.
+           Nothing is written to played.json/queued.json, the same rng seed always gives the same day."""
+        logging.debug(f"Begin plan_day for {day}")
+        start_time = datetime.combine(day, datetime.min.time())
+        return self.build_playlist(start_time, 24 * 60 * 60, rng, track=False)
+
+    def build_playlist(self, start_time: datetime, secs_left: int, rng: random.Random, track: bool = True, exclude: set[int] | None = None) -> list[PlanEntry]:
+        """Builds a playlist of secs_left seconds starting at start_time.
+           When track is False the played/queued trackers are left untouched (used for guide planning).
+           Shows and ads in exclude (media ids, e.g. already aired when re-planning) are left out until their pool runs out."""
+        logging.debug(f"Begin build_playlist")
+        playlist: list[PlanEntry] = []
+        current_time = start_time
+        logging.debug(f"Current time: {current_time}")
 
-        # Maintain per-schedule in-memory lists of available shows/ads
-        schedule_pools: dict[str, dict[str, list[str]]] = {}
+        # Maintain per-schedule in-memory arrays of available shows/ads (media ids)
+        schedule_pools: dict[str, dict[Category, array.array]] = {}
 
         # Track last played per schedule/category
-        last_played: dict[tuple[str, str], str] = {}
+        last_played: dict[tuple[str, Category], int] = {}
 
         while secs_left > 0:
             logging.debug(f"Contine Loop - Secs left: {secs_left}")
-            active = self.config.get_active_schedule_at(current_time)   # get the active schedule object for the time (time is shifted as we build the playlist)
-            if not active:
+            schedule_name = self.config.get_active_schedule_name_at(current_time)   # get the name of the active schedule for the time (time is shifted as we build the playlist)
+            if schedule_name is None:
                 logging.debug(f"No active schedule at {current_time}, please define one!")
                 break
-            else:
-                logging.debug(f"Active schedule determined from {active.starthour}:{active.startminute}-{active.endhour}:{active.endminute}")
-
-            # find the schedule name (dict key) for this schedule object
-            schedule_name = next((n for n, s in self.config.schedules.items() if s is active), None)    # get the name of the schedule
-            if schedule_name is None:
-                logging.debug(f"Schedule name could not be determined!")
-                schedule_name = "unknown"
-            else:
-                logging.debug(f"Schedule name: {schedule_name}")
+            active = self.config.schedules[schedule_name]
+            logging.debug(f"Active schedule {schedule_name} determined from {active.starthour}:{active.startminute}-{active.endhour}:{active.endminute}")
 
             # Initialize pools for this schedule if not already
             if schedule_name not in schedule_pools:
                 logging.debug(f"Schedule name {schedule_name} not in pool, add shows/ads/bumpers")
-                shows = sum((get_media_files(p) for p in active.shows), [])
-                ads = sum((get_media_files(p) for p in active.ads), [])
-                bumpers = sum((get_media_files(p) for p in active.bumpers), [])
                 schedule_pools[schedule_name] = {
-                    "shows": shows,
-                    "ads": ads,
-                    "bumpers": bumpers
+                    Category.SHOWS: self._media_ids(active.shows),
+                    Category.ADS: self._media_ids(active.ads),
+                    Category.BUMPERS: self._media_ids(active.bumpers)
                 }
+                if exclude:
+                    for category in (Category.SHOWS, Category.ADS):
+                        pool_ids = schedule_pools[schedule_name][category]
+                        schedule_pools[schedule_name][category] = array.array("I", (i for i in pool_ids if i not in exclude))
             else:
                 logging.debug(f"Schedule name: {schedule_name} already in pool")
 
             pool = schedule_pools[schedule_name]
 
             # Reset per-schedule played if pools exhausted
-            for category in ("shows", "ads"):
-                if not pool[category]:      # if the list of "shows" or "ads" is empty
-                    logging.debug(f"Pool {pool[category]} is exhausted")
-                    self.tracker.reset_if_exhausted(schedule_name, category)    # reset the json
-                    files = sum((get_media_files(p) for p in getattr(active, category)), []) # re-gather files from disk
+            for category in (Category.SHOWS, Category.ADS):
+                if not pool[category]:      # if the pool of shows or ads is empty
+                    logging.debug(f"Pool {category.label} is exhausted")
+                    if track:
+                        self.tracker.reset_if_exhausted(schedule_name, category.label)    # reset the json
+                    ids = self._media_ids(getattr(active, category.label)) # re-gather files from disk
                     logging.debug(f"Refill pool from files on disk")
-                    pool[category] = files  # refill the pool
+                    pool[category] = ids  # refill the pool
 
                 else:
-                    logging.debug(f"Pool {pool[category]} is not empty")
+                    logging.debug(f"Pool {category.label} is not empty, {len(pool[category])} left")
 
             candidate, category, dur = None, None, 0    # set up an object to be filled by pick method
 
-            def pick(files: list[str], cat: str, force=False):
+            def pick(files: array.array, cat: Category, force=False):
                 logging.debug(f"Begin pick")
                 nonlocal candidate, category, dur
                 if not files:
                     logging.debug(f"No files! returning false")
                     return False
                 logging.debug(f"Shuffling files")
-                shuffled = files[:]
-                random.shuffle(shuffled)
+                shuffled = self._shuffled(files, rng)
 
                 # avoid repeating the last played if possible
                 last = last_played.get((schedule_name, cat))
@@ -103,7 +152,7 @@ class QueuePlanner:
                         continue  # skip immediate repeat after reset
 
                     logging.debug(f"Get duration of choice {choice}")
-                    d = int(self.durations["by_path"].get(choice, 0))
+                    d = self.durations.duration_of(choice)
                     logging.debug(f"Duration is: {d}")
                     if d <= 0:
                         logging.debug(f"Duration {d}, less than zero!, skipping")
@@ -111,7 +160,7 @@ class QueuePlanner:
                     logging.debug(f"Force: {force}")
                     if force or d <= secs_left:
                         candidate, category, dur = choice, cat, d
-                        if cat in ("shows", "ads"):
+                        if cat in (Category.SHOWS, Category.ADS):
                             # remove picked file from in-memory pool
                             logging.debug(f"Removing choice {choice} from files pool and returning true")
                             files.remove(choice)
@@ -122,11 +171,11 @@ class QueuePlanner:
                 return False
 
             # Try picking in order: shows → ads → bumpers
-            if not pick(pool["shows"], "shows"):
+            if not pick(pool[Category.SHOWS], Category.SHOWS):
                 logging.debug(f"Unable to pick a show!")
-                if not pick(pool["ads"], "ads"):
+                if not pick(pool[Category.ADS], Category.ADS):
                     logging.debug(f"Unable to pick an ad!")
-                    if not pick(pool["bumpers"], "bumpers", force=True):
+                    if not pick(pool[Category.BUMPERS], Category.BUMPERS, force=True):
                         logging.debug(f"Unable to pick a bumper! Something very wrong!")
                         break  # very unlikely with bumpers
 
@@ -135,29 +184,28 @@ class QueuePlanner:
                 break
 
             # If we are about to play a show, randomly add a bumper before it based on config file value
-            if category == "shows" and pool["bumpers"]:
+            if category == Category.SHOWS and pool[Category.BUMPERS]:
                 logging.debug(f"Randomly add bumper before show")
-                if random.random() < getattr(active, "bumper_chance", 0.5): # get from config file, default to 50%
+                if rng.random() < getattr(active, "bumper_chance", 0.5): # get from config file, default to 50%
                     logging.debug("Adding bumper")
                     bumper_candidate, bumper_dur = None, 0
 
-                    def pick_bumper(files: list[str]):
+                    def pick_bumper(files: array.array):
                         nonlocal bumper_candidate, bumper_dur
                         if not files:
                             return False
-                        shuffled = files[:]
-                        random.shuffle(shuffled)
+                        shuffled = self._shuffled(files, rng)
                         for choice in shuffled:
-                            d = int(self.durations["by_path"].get(choice, 0))
+                            d = self.durations.duration_of(choice)
                             if d <= 0:
                                 continue
                             bumper_candidate, bumper_dur = choice, d
                             return True
                         return False
 
-                    if pick_bumper(pool["bumpers"]):
+                    if pick_bumper(pool[Category.BUMPERS]):
                         # Append bumper first
-                        playlist.append((bumper_candidate, "bumpers"))
+                        playlist.append(self._entry(bumper_candidate, Category.BUMPERS, current_time, bumper_dur))
                         secs_left -= bumper_dur
                         current_time += timedelta(seconds=bumper_dur)
                         logging.debug(f"Inserted {bumper_candidate} ({bumper_dur}s) before show")
@@ -166,20 +214,22 @@ class QueuePlanner:
 
             logging.debug(f"Added {candidate} candidate to playlist")
 
-            self.queue_tracker.mark_queued(pathlib.Path(candidate).stem, category, current_time)
-            playlist.append((candidate, category))
+            if track:
+                path = self.durations.path_of(candidate)
+                self.queue_tracker.mark_queued(pathlib.Path(path).stem, category.label, current_time, path)
+            playlist.append(self._entry(candidate, category, current_time, dur))
             secs_left -= dur
             logging.debug(f"secs_left: {secs_left}")
             current_time += timedelta(seconds=dur)
             logging.debug(f"current_time: {current_time}")
 
             # If we just added a show then add 2 ads immediately (if they fit)
-            if category == "shows":
+            if category == Category.SHOWS:
                 for _ in range(2):
                     logging.debug(f"Adding 2 ads before next show")
-                    if pick(pool["ads"], "ads"):
+                    if pick(pool[Category.ADS], Category.ADS):
                         logging.debug(f"Appending ad to playlist {candidate}")
-                        playlist.append(((candidate), category))
+                        playlist.append(self._entry(candidate, category, current_time, dur))
                         logging.debug(f"secs_left: {secs_left}")
                         secs_left -= dur
                         logging.debug(f"current_time: {current_time}")
@@ -1,29 +1,68 @@
 import os
 import vlc
+import time
+import queue
 import logging
-import urllib.parse
+import threading
 from tracker import PlayedTracker
-from models import Config
-from datetime import datetime
+from health import HealthIndex
+from prefetch import Prefetcher
+from models import Config, PlanEntry
+from compactdurations import CompactDurations
+from datetime import datetime, timedelta
 
 class PlaylistManager:
     """
-    Wraps VLC MediaListPlayer, tracks (file and category) so we can mark
-    played items via VLCs MediaPlayerEndReached event.
+    Wraps VLC MediaListPlayer, tracks the planned entry (media id and category) of each
+    item so we can mark played items via VLCs MediaPlayerEndReached event.
+    Media ids are only turned into paths when an item is handed to VLC or finishes.
     """
-    def __init__(self, config: Config, tracker: PlayedTracker):
+    STATS_INTERVAL = 5  # seconds between decode stats samples
+
+    def __init__(self, config: Config, tracker: PlayedTracker, durations: CompactDurations, health: HealthIndex | None = None):
         logging.debug("Init PlaylistManager")
         self.config = config            # store config so we can use it later
         self.tracker = tracker          # store tracker
+        self.durations = durations      # resolves media ids to paths
+        self.health = health            # per-file decode health, None = don't sample
         logging.debug("Create VLC instance")
-        self.instance = vlc.Instance()  # create vlc instance
+        self.instance = vlc.Instance(*config.system.vlc_args)  # create vlc instance, channels may pick their own outputs
 
         self.media_list = self.instance.media_list_new()
         self.list_player = self.instance.media_list_player_new()
         self.list_player.set_media_list(self.media_list)
 
-        # map MRL to category
-        self.category_by_mrl: dict[str, str] = {}
+        # planned entries in media list order (with the offset each starts at), VLC events give us the
+        # media list index so this is all that is needed to know what started/finished
+        self.entries: list[PlanEntry] = []
+        self.offsets: list[int] = []
+
+        # drift tracking, current item and when it actually started
+        self.current_index = -1
+        self.current_started: datetime | None = None
+        self.drift_seconds = 0.0        # actual start - planned start of the current item
+        self.max_drift_seconds = 0.0    # largest drift seen (either way) since startup
+        self.replans = 0                # number of times the rest of the plan was rebuilt
+        self.duration_corrections = 0   # number of durations corrected from real playback
+        self.replanner = None           # callable(start_time) -> list[PlanEntry], set by main
+        self.on_duration_corrected = None   # callable(path, seconds), set by main
+        self.on_first_frame = None      # callable(), called once when video first appears, set by main for the boot timeline
+
+        # latest decode stats per media list index (displayed, lost, max demux bitrate), filled in by the sampler thread
+        self.stats_by_index: dict[int, tuple[int, int, float]] = {}
+        if self.health:
+            self.sampler = threading.Thread(target=self._sample_stats, daemon=True)
+            self.sampler.start()
+
+        # VLC events are queued and handled on our own thread so libVLC's event thread is never blocked
+        self.events: queue.Queue[tuple] = queue.Queue()
+        self.worker = threading.Thread(target=self._process_events, daemon=True)
+        self.worker.start()
+
+        # read ahead upcoming files so slow drives/shares are ready when VLC opens them
+        self.prefetcher = None
+        if config.system.prefetch_items > 0:
+            self.prefetcher = Prefetcher(config.system.prefetch_mb * 1024 * 1024)
 
         # attach end event
         logging.debug("Setup VLC Event for MediaPlayerEndReached")
@@ -31,64 +70,210 @@ class PlaylistManager:
         em = mp.event_manager()
         em.event_attach(vlc.EventType.MediaPlayerEndReached, self.on_media_end)
 
-    def on_media_end(self, event):
+        # attach video output event, fires once the first picture is on screen
+        em.event_attach(vlc.EventType.MediaPlayerVout, self.on_vout)
 
-        logging.debug("Begin on_media_end")
-        mp = self.list_player.get_media_player()
-        media = mp.get_media()
-        if not media:
+        # attach next item event, fires as each item starts
+        logging.debug("Setup VLC Event for MediaListPlayerNextItemSet")
+        lem = self.list_player.event_manager()
+        lem.event_attach(vlc.EventType.MediaListPlayerNextItemSet, self.on_next_item)
+
+    def on_next_item(self, event):
+        """Runs on the libVLC event thread, only timestamps the start and hands the upcoming paths to the prefetcher"""
+        started = datetime.now()
+        # event.u.media is a bare pointer in python-vlc, the media player already has the new item set so ask it instead
+        index = self._index_of(self.list_player.get_media_player().get_media())
+        if index < 0:
             return
+        self.events.put(("start", index, started))
+        if self.prefetcher:
+            self.prefetch_after(index)
+
+    def _index_of(self, media) -> int:
+        """Media list index of a media, -1 if it isn't (or is no longer) in the list. Safe from any thread"""
+        if not media:
+            return -1
+        self.media_list.lock()     # libVLC requires the lock, replan_after may be changing the list
+        try:
+            return self.media_list.index_of_item(media)
+        finally:
+            self.media_list.unlock()
+
+    def prefetch_after(self, index: int):
+        """Warm the files queued after the item at index"""
+        upcoming = self.entries[index + 1:index + 1 + self.config.system.prefetch_items]
+        self.prefetcher.prefetch([self._play_path(e) for e in upcoming])
+
+    def on_vout(self, event):
+        """Runs on the libVLC event thread, only the first one matters"""
+        callback, self.on_first_frame = self.on_first_frame, None
+        if callback:
+            callback()
+
+    def on_media_end(self, event):
+        """Runs on the libVLC event thread, so only note what ended and hand it to the worker"""
+        ended = datetime.now()
+        index = self._index_of(self.list_player.get_media_player().get_media())
+        if index >= 0:
+            self.events.put(("end", index, ended))
 
-        mrl = media.get_mrl()  # e.g., file:///path/to/video.mp4
-        logging.debug(f"mrl is: {mrl}")
-        category = self.category_by_mrl.get(mrl)  # e.g., "shows", "ads", "bumpers"
-        logging.debug(f"category is: {category}")
-
-        # Convert MRL to OS path
-        path = mrl
-        logging.debug(f"path is: {path}")
-        if mrl.startswith("file://"):
-            logging.debug(f"mrl starts with file://")
-            raw = mrl.replace("file:///", "", 1)
-            logging.debug(f"raw is: {raw}")
-            raw = urllib.parse.unquote(raw)  # decode %20 → space
-            logging.debug(f"raw is: {raw}")
-
-            if os.name == "nt":
-                raw = raw.replace("/", "\\")
-                logging.debug(f"OS is {os.name}, raw is: {raw}")
-            path = os.path.normpath(raw)
-            logging.debug(f"path is {path}")
-        else:
-            logging.debug(f"mrl doesnt start with file://")
-            path = mrl
-
-        # Determine active schedule at the current time
-        now = datetime.now()
-        logging.debug(f"datetime now is: {now}")
-        active_schedule = self.config.get_active_schedule_at(now)
-        logging.debug(f"active schedule retrieved")
-        if active_schedule:
-            logging.debug(f"Get schedule name")
-            schedule_name = next((n for n, s in self.config.schedules.items() if s is active_schedule),"global")
-            logging.debug(f"schedule name is {schedule_name}")
-        else:
+    def _process_events(self):
+        """Worker thread, does the bookkeeping for each item that started or finished playing"""
+        while True:
+            kind, key, when = self.events.get()
+            try:
+                if kind == "start":
+                    self._handle_media_start(key, when)
+                else:
+                    self._handle_media_end(key, when)
+            except Exception as e:
+                logging.error(f"Failed to handle {kind} of {key}: {e}")
+
+    def _sample_stats(self):
+        """Background thread, samples libVLC's decode stats for whatever is playing"""
+        stats = vlc.MediaStats()
+        while True:
+            time.sleep(self.STATS_INTERVAL)
+            try:
+                media = self.list_player.get_media_player().get_media()
+                if not media or not media.get_stats(stats):
+                    continue
+                index = self._index_of(media)
+                if index < 0:
+                    continue    # removed by a re-plan since
+                _, _, max_bitrate = self.stats_by_index.get(index, (0, 0, 0.0))
+                # the picture counters are totals for the media, the bitrate is a point in time reading
+                self.stats_by_index[index] = (stats.displayed_pictures, stats.lost_pictures, max(max_bitrate, stats.demux_bitrate))
+            except Exception as e:
+                logging.error(f"Failed to sample decode stats: {e}")
+
+    def _handle_media_start(self, index: int, started_at: datetime):
+        """Compare the actual start against the plan, re-plan the rest of the day if it has drifted too far"""
+        logging.debug(f"Begin _handle_media_start for item {index}")
+        self.current_index = index
+        self.current_started = started_at
+        entry = self.entries[index]
+
+        # an item joined part way through was planned to start earlier by its offset
+        planned = entry.start + timedelta(seconds=self.offsets[index])
+        self.drift_seconds = (started_at - planned).total_seconds()
+        if abs(self.drift_seconds) > abs(self.max_drift_seconds):
+            self.max_drift_seconds = self.drift_seconds
+        logging.debug(f"Item {index} started {self.drift_seconds:.1f}s from plan")
+
+        if abs(self.drift_seconds) > self.config.system.drift_threshold and self.replanner:
+            if self.drift_seconds < 0 and self.config.system.guide_seed is not None:
+                # the guide is fixed, re-planning from an earlier time gives back the same entries so running ahead
+                # can't be fixed that way. Durations are rounded up so this is usual, playback just starts each item a little early
+                logging.debug(f"Playback is {-self.drift_seconds:.1f}s ahead of the guide, not re-planning")
+                return
+            logging.debug(f"Drift {self.drift_seconds:.1f}s is over {self.config.system.drift_threshold}s, re-planning")
+            self.replan_after(index, started_at + timedelta(seconds=entry.duration - self.offsets[index]))
+
+    def _handle_media_end(self, index: int, ended_at: datetime):
+        logging.debug(f"Begin _handle_media_end for item {index}")
+        entry = self.entries[index]
+        path = self.durations.path_of(entry.media_id)
+        category = entry.category.label
+
+        # Determine active schedule at the time the item ended
+        schedule_name = self.config.get_active_schedule_name_at(ended_at)
+        if schedule_name is None:
             logging.debug(f"no active schedule! set to 'global'")
             schedule_name = "global"
 
-        if category:
-            logging.debug(f"Finished: {path} ({category}),  marking played under schedule '{schedule_name}'")
-            self.tracker.mark_played(schedule_name, path, category)
-        else:
-            logging.debug(f"Finished: {path} (unknown category)")
+        logging.debug(f"Finished: {path} ({category}),  marking played under schedule '{schedule_name}'")
+        self.tracker.mark_played(schedule_name, path, category)
+
+        # store how well it decoded against the file
+        if self.health and index in self.stats_by_index:
+            displayed, lost, max_bitrate = self.stats_by_index.pop(index)
+            self.health.record(path, displayed, lost, max_bitrate)
 
-    def add_to_playlist(self, file_path: str, category: str):
+        # If the item played in full compare how long it really took with the stored duration
+        if self.current_started is None or index != self.current_index or self.offsets[index] > 0:
+            return
+        actual = round((ended_at - self.current_started).total_seconds())
+        if abs(actual - entry.duration) >= max(2, entry.duration * 0.02):
+            logging.debug(f"{path} played for {actual}s but duration is {entry.duration}s, correcting")
+            self.duration_corrections += 1
+            if self.on_duration_corrected:
+                self.on_duration_corrected(path, actual)
+
+    def replan_after(self, index: int, start_time: datetime):
+        """Throw away everything queued after index and ask the planner for a fresh plan from start_time"""
+        # anything planned to start before the current item is already behind us
+        current_start = self.entries[index].start
+        new_plan = [e for e in self.replanner(start_time) if e.start > current_start]
+        self.media_list.lock()
+        try:
+            # remove from the end backwards so indexes don't shift underneath us
+            for i in range(self.media_list.count() - 1, index, -1):
+                self.media_list.remove_index(i)
+            del self.entries[index + 1:]
+            del self.offsets[index + 1:]
+            for i in [i for i in self.stats_by_index if i > index]:
+                del self.stats_by_index[i]
+            for entry in new_plan:
+                offset = max(0, int((start_time - entry.start).total_seconds()))
+                self._add(entry, offset)
+        finally:
+            self.media_list.unlock()
+        self.replans += 1
+        # the next item should now start on plan, drift is how far off that is (an item joined part way through starts late by its offset)
+        if new_plan:
+            self.drift_seconds = (start_time - (new_plan[0].start + timedelta(seconds=self.offsets[index + 1]))).total_seconds()
+        logging.debug(f"Re-planned {len(new_plan)} items from {start_time}")
+
+    def add_to_playlist(self, entry: PlanEntry, start_offset: int = 0):
         logging.debug(f"Begin add_to_playlist")
-        media = self.instance.media_new_path(file_path)
-        mrl = media.get_mrl()
+        self.media_list.lock()
+        try:
+            self._add(entry, start_offset)
+        finally:
+            self.media_list.unlock()
+
+    def _play_path(self, entry: PlanEntry) -> str:
+        """Path VLC should open, the proxy if the planner found one"""
+        return entry.play_path or self.durations.path_of(entry.media_id)
+
+    def _add(self, entry: PlanEntry, start_offset: int):
+        """Add a planned entry to the media list, caller must hold the media list lock"""
+        play_path = self._play_path(entry)
+        media = self.instance.media_new_path(play_path)
+        if start_offset > 0:
+            logging.debug(f"Starting {play_path} {start_offset}s in")
+            media.add_option(f":start-time={start_offset}")
         self.media_list.add_media(media)
-        self.category_by_mrl[mrl] = category
-        logging.debug(f"{file_path} ({category}) added to playlist, total items: {self.media_list.count()}")
+        self.entries.append(entry)
+        self.offsets.append(start_offset)
+        logging.debug(f"{play_path} ({entry.category.label}) added to playlist, total items: {self.media_list.count()}")
+
+    def now_playing(self) -> dict | None:
+        """What is on screen right now, None before the first item starts"""
+        index = self.current_index
+        if index < 0 or self.current_started is None:
+            return None
+        entry = self.entries[index]
+        path = self.durations.path_of(entry.media_id)
+        return {
+            "title": os.path.splitext(os.path.basename(path))[0],
+            "filepath": path,
+            "category": entry.category.label,
+            "started": self.current_started.isoformat(timespec="seconds"),
+            "duration": entry.duration,
+            "offset": self.offsets[index]
+        }
+
+    def get_metrics(self) -> dict:
+        """Drift and re-plan figures for the web ui"""
+        return {
+            "drift_seconds": round(self.drift_seconds, 1),
+            "max_drift_seconds": round(self.max_drift_seconds, 1),
+            "drift_threshold": self.config.system.drift_threshold,
+            "replans": self.replans,
+            "duration_corrections": self.duration_corrections
+        }
 
     def start_playback(self):
         logging.debug(f"Begin start_playback")
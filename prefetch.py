@@ -0,0 +1,60 @@
+import os
+import queue
+import logging
+import threading
+
+READ_CHUNK = 1024 * 1024    # 1MB sequential reads when fadvise isn't available
+
+class Prefetcher:
+    """
+    Warms the page cache with the start of upcoming media files so the drive
+    has spun up / the network share has fetched before VLC opens the file.
+    Runs on its own thread, requests are dropped if the file was recently prefetched.
+    """
+
+    def __init__(self, byte_budget: int):
+        logging.debug(f"Init Prefetcher with budget {byte_budget} bytes")
+        self.byte_budget = byte_budget
+        self.requests: queue.Queue[tuple[str, int]] = queue.Queue()
+        self.recent: list[str] = []     # last few files warmed, so repeated requests are ignored
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def prefetch(self, paths: list[str]):
+        """Queue files to be warmed, the byte budget is split evenly between them"""
+        if not paths:
+            return
+        per_file = self.byte_budget // len(paths)
+        for path in paths:
+            if path in self.recent:
+                logging.debug(f"{path} was prefetched recently, skipping")
+                continue
+            logging.debug(f"Queue prefetch of {path}")
+            self.recent.append(path)
+            self.requests.put((path, per_file))
+        del self.recent[:-8]
+
+    def _run(self):
+        while True:
+            path, budget = self.requests.get()
+            try:
+                self._warm(path, budget)
+            except OSError as e:
+                logging.error(f"Prefetch of {path} failed: {e}")
+
+    def _warm(self, path: str, budget: int):
+        size = os.path.getsize(path)
+        length = min(size, budget)
+        logging.debug(f"Prefetching {length} of {size} bytes from {path}")
+        with open(path, "rb", buffering=0) as f:
+            # ask the kernel to read ahead for us, then still touch the data
+            # as network filesystems often ignore the hint
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(f.fileno(), 0, length, os.POSIX_FADV_WILLNEED)
+            remaining = length
+            while remaining > 0:
+                chunk = f.read(min(READ_CHUNK, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+        logging.debug(f"Prefetch of {path} complete")
@@ -0,0 +1,97 @@
+import os
+import time
+import queue
+import logging
+import threading
+
+VIDEO_EXTS = ('.mkv', '.mp4', '.avi')
+SCAN_TIMEOUT = 30   # default seconds a single folder may take before it is reported unreachable (system.scan_timeout)
+SCAN_WORKERS = 4    # folders scanned at once
+
+# Media folders are often NFS/SMB mounts, walking them one after another adds up every round trip
+# and a mount that hangs blocks os.walk forever. Folders are scanned here by a few daemon threads at once,
+# a folder that takes longer than the timeout is given up on (its thread is left behind, it can't be interrupted)
+# and whatever was found in it so far is returned with the folder flagged as unreachable.
+
+def _scan_folder(folder: str, found: list[str]):
+    """Walk a folder with os.scandir, appending media files to found as they turn up.
+       Only the folder itself failing raises, unreadable subfolders (e.g. lost+found) are skipped like os.walk does"""
+    pending = [folder]
+    while pending:
+        current = pending.pop()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    try:
+                        is_dir = entry.is_dir() and not entry.is_symlink()  # same as os.walk, symlinked folders aren't followed
+                    except OSError:
+                        is_dir = False
+                    if is_dir:
+                        pending.append(entry.path)
+                    elif entry.name.lower().endswith(VIDEO_EXTS):
+                        found.append(entry.path)
+        except OSError as e:
+            if current == folder:
+                raise
+            logging.error(f"Skipping unreadable folder {current}: {e}")
+
+def scan_folders(folders: list[str], timeout: float = SCAN_TIMEOUT, workers: int = SCAN_WORKERS) -> tuple[dict[str, list[str]], set[str]]:
+    """
+    Scan folders concurrently, returns folder -> media files and the set of folders that could not be scanned in full
+    (missing or unreadable itself, or timed out). Files found in a timed out folder before giving up are still returned.
+    """
+    folders = list(dict.fromkeys(folders))  # deduplicate, keep order
+    found: dict[str, list[str]] = {folder: [] for folder in folders}
+    started: dict[str, float] = {}
+    done: set[str] = set()
+    unreachable: set[str] = set()
+    lock = threading.Lock()
+    todo: queue.Queue = queue.Queue()
+    for folder in folders:
+        todo.put(folder)
+
+    def worker():
+        while True:
+            try:
+                folder = todo.get_nowait()
+            except queue.Empty:
+                return
+            with lock:
+                started[folder] = time.monotonic()
+            logging.debug(f"Begin scanning {folder}")
+            try:
+                _scan_folder(folder, found[folder])
+            except OSError as e:
+                logging.error(f"Could not scan {folder}: {e}")
+                with lock:
+                    unreachable.add(folder)
+            with lock:
+                done.add(folder)
+            logging.debug(f"Finished scanning {folder}, {len(found[folder])} files")
+
+    workers = max(1, min(workers, len(folders)))
+    for _ in range(workers):
+        threading.Thread(target=worker, daemon=True).start()
+
+    # wait until every folder is done or given up on
+    while True:
+        with lock:
+            now = time.monotonic()
+            pending = [f for f in folders if f not in done]
+            timed_out = [f for f in pending if f in started and now - started[f] > timeout]
+            waiting = [f for f in pending if f not in started]
+        running = len(pending) - len(timed_out) - len(waiting)
+        if running == 0 and (not waiting or len(timed_out) >= workers):
+            # nothing left that could still finish, either everything is done or every worker is stuck on a hung folder
+            break
+        time.sleep(0.05)
+
+    for folder in pending:
+        if folder in started:
+            logging.error(f"Scanning {folder} timed out after {timeout}s, using the {len(found[folder])} files found so far")
+        else:
+            logging.error(f"{folder} was not scanned, every scan thread is stuck on a hung folder")
+        unreachable.add(folder)
+
+    # copy the lists, threads left on a hung folder may still append to them
+    return {folder: list(files) for folder, files in found.items()}, unreachable
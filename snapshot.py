@@ -0,0 +1,89 @@
+import os
+import json
+import mmap
+import time
+import struct
+import logging
+import threading
+
+SNAPSHOT_BIN = "snapshot.bin"
+SNAPSHOT_SIZE = 256 * 1024      # fixed size of the file, the json has to fit after the header
+SNAPSHOT_INTERVAL = 2           # seconds between snapshots
+
+# Player state (now playing, metrics, boot timeline) shared with a web UI running in its own process.
+# The player writes a small json document into a memory mapped file, the web UI maps the same file and reads it,
+# neither side ever waits on the other. The header is a sequence number (seqlock): it is made odd while a write
+# is in progress and even again once done, a reader that sees an odd number, or a different number after reading, retries.
+#
+#   header      sequence (uint64), json length (uint32)
+#   payload     utf-8 json
+
+HEADER = struct.Struct("=QI")
+
+class SnapshotWriter:
+    """Writes snapshots, there must only be one writer per file"""
+
+    def __init__(self, path: str = SNAPSHOT_BIN):
+        logging.debug(f"Init SnapshotWriter with path {path}")
+        self.path = path
+        # not truncated to nothing first, a reader may have the file from the last run mapped
+        fd = os.open(path, os.O_RDWR | os.O_CREAT)
+        try:
+            os.ftruncate(fd, SNAPSHOT_SIZE)
+            self.mm = mmap.mmap(fd, SNAPSHOT_SIZE)
+        finally:
+            os.close(fd)
+        self.sequence = 0
+        HEADER.pack_into(self.mm, 0, 0, 0)     # nothing written yet
+
+    def write(self, state: dict):
+        payload = json.dumps(state).encode("utf-8")
+        if HEADER.size + len(payload) > SNAPSHOT_SIZE:
+            logging.error(f"Snapshot is {len(payload)} bytes, too big for {self.path}, skipped")
+            return
+        self.sequence += 1      # odd, readers keep off
+        HEADER.pack_into(self.mm, 0, self.sequence, len(payload))
+        self.mm[HEADER.size:HEADER.size + len(payload)] = payload
+        self.sequence += 1      # even, done
+        HEADER.pack_into(self.mm, 0, self.sequence, len(payload))
+
+def read_snapshot(path: str = SNAPSHOT_BIN, retries: int = 50) -> dict | None:
+    """Read the latest snapshot, None if there isn't one (yet)"""
+    if not os.path.exists(path) or os.path.getsize(path) < HEADER.size:
+        return None
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        for _ in range(retries):
+            sequence, length = HEADER.unpack_from(mm, 0)
+            if sequence == 0:
+                return None     # nothing written yet
+            if sequence % 2 == 0:
+                payload = mm[HEADER.size:HEADER.size + length]
+                if HEADER.unpack_from(mm, 0)[0] == sequence:
+                    # there are no memory barriers here, on ARM a torn payload can still get past the sequence check
+                    try:
+                        return json.loads(payload)
+                    except ValueError:
+                        pass
+            time.sleep(0.001)   # caught a write part way through, try again
+        logging.error(f"Could not get a consistent snapshot from {path}")
+        return None
+    finally:
+        mm.close()
+
+def start_snapshot_thread(path: str, get_state, interval: float = SNAPSHOT_INTERVAL) -> threading.Thread:
+    """Write get_state() to the snapshot every interval seconds from a background thread"""
+    writer = SnapshotWriter(path)
+
+    def run():
+        while True:
+            try:
+                writer.write(get_state())
+            except Exception as e:
+                logging.error(f"Failed to write snapshot: {e}")
+            time.sleep(interval)
+
+    t = threading.Thread(target=run, daemon=True)
+    t.start()
+    return t
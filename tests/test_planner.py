@@ -0,0 +1,83 @@
+import os
+import sys
+import random
+import unittest
+from datetime import datetime
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utils
+from models import Schedule, System, Config
+from planner import QueuePlanner
+
+
+class FakeDurations:
+    """Stand in for CompactDurations, every file is 600s"""
+
+    def __init__(self, paths):
+        self.paths = list(paths)
+
+    def __contains__(self, path):
+        return path in self.paths
+
+    def id_of(self, path):
+        return self.paths.index(path) if path in self.paths else -1
+
+    def path_of(self, media_id):
+        return self.paths[media_id]
+
+    def duration_of(self, media_id):
+        return 600
+
+
+class PoolRefillTest(unittest.TestCase):
+
+    def setUp(self):
+        utils.media_index = None
+        utils.unreachable_folders.clear()
+        self.shows = [f"/shows/{i}.mp4" for i in range(3)]
+        schedule = Schedule(priority=1, daysofweek=[0], dates=[0], months=[0], starthour=0, startminute=0, endhour=0, endminute=0,
+                            shows=["/shows"], ads=["/ads"], bumpers=["/bumpers"], bumper_chance=0.0)
+        system = System(action="restart", hour=3, minute=0, bumper_chance=0.0, channel_name="test", scan_timeout=1)
+        self.config = Config(schedules={"all": schedule}, system=system)
+
+    def tearDown(self):
+        utils.unreachable_folders.clear()
+
+    def test_unreachable_root_is_not_scanned_on_every_refill(self):
+        scanned = []
+
+        def scan_folders(folders, timeout):
+            scanned.extend(folders)
+            found = {"/shows": list(self.shows), "/ads": [], "/bumpers": []}
+            return {f: found[f] for f in folders}, {f for f in folders if f == "/ads"}    # the ads share doesn't answer
+
+        planner = QueuePlanner(self.config, None, None, FakeDurations(self.shows), self.config.system)
+        with mock.patch.object(utils, "scan_folders", side_effect=scan_folders):
+            plan = planner.build_playlist(datetime(2026, 1, 1), 8 * 60 * 60, random.Random(1), track=False)
+
+        # 8 hours of 10 minute shows empties the shows pool many times and the ads pool on every pick
+        self.assertEqual(len(plan), 48)
+        self.assertEqual(scanned.count("/ads"), 1)
+
+    def test_media_index_answers_refills(self):
+        utils.media_index = {"/shows": list(self.shows), "/ads": [], "/bumpers": []}
+        planner = QueuePlanner(self.config, None, None, FakeDurations(self.shows), self.config.system)
+        with mock.patch.object(utils, "scan_folders") as scan_folders:
+            plan = planner.build_playlist(datetime(2026, 1, 1), 2 * 60 * 60, random.Random(1), track=False)
+        self.assertEqual(len(plan), 12)
+        scan_folders.assert_not_called()
+        utils.media_index = None
+
+    def test_excluded_shows_are_not_picked_again(self):
+        shows = [f"/shows/{i}.mp4" for i in range(6)]
+        utils.media_index = {"/shows": shows, "/ads": [], "/bumpers": []}
+        planner = QueuePlanner(self.config, None, None, FakeDurations(shows), self.config.system)
+        plan = planner.build_playlist(datetime(2026, 1, 1), 30 * 60, random.Random(1), track=False, exclude={0, 1, 2})
+        self.assertEqual(sorted(e.media_id for e in plan), [3, 4, 5])
+        utils.media_index = None
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import scanner
+
+
+class ScanFoldersTest(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.tmp = tempfile.TemporaryDirectory()
+        self.lib = os.path.join(self.tmp.name, "lib")
+        for name in ("a/1.mp4", "b/2.mp4", "lost+found/x.mkv", "top.avi", "notes.txt"):
+            path = os.path.join(self.lib, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path, "w").close()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_finds_media_files_recursively(self):
+        found, unreachable = scanner.scan_folders([self.lib])
+        names = sorted(os.path.relpath(p, self.lib) for p in found[self.lib])
+        self.assertEqual(names, ["a/1.mp4", "b/2.mp4", "lost+found/x.mkv", "top.avi"])
+        self.assertEqual(unreachable, set())
+
+    def test_unreadable_subfolder_is_skipped(self):
+        real_scandir = os.scandir
+        unreadable = os.path.join(self.lib, "lost+found")
+
+        def scandir(path):
+            if path == unreadable:
+                raise PermissionError(13, "Permission denied", path)
+            return real_scandir(path)
+
+        with mock.patch.object(scanner.os, "scandir", side_effect=scandir):
+            found, unreachable = scanner.scan_folders([self.lib])
+        names = sorted(os.path.relpath(p, self.lib) for p in found[self.lib])
+        self.assertEqual(names, ["a/1.mp4", "b/2.mp4", "top.avi"])
+        self.assertEqual(unreachable, set())
+
+    def test_missing_root_is_unreachable(self):
+        missing = os.path.join(self.tmp.name, "gone")
+        found, unreachable = scanner.scan_folders([self.lib, missing])
+        self.assertEqual(found[missing], [])
+        self.assertEqual(unreachable, {missing})
+        self.assertEqual(len(found[self.lib]), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+import os
+import json
+import time
+import logging
+import multiprocessing
+from durationcache import DurationCache
+
+THUMBS_DIR = os.path.join("static", "thumbs")
+THUMBS_INDEX = os.path.join(THUMBS_DIR, "index.json")
+THUMB_WIDTH = 160       # px, the guide shows them small
+THUMB_POSITION = 0.1    # how far into the file the picture is taken, past any intro/black frames
+THUMB_MAX_LOAD = 0.5    # per cpu core, only work while the 1 minute load average is below this
+IDLE_CHECK = 30         # seconds between load checks while waiting for the Pi to be idle
+
+# Background thumbnails for the guide, one small picture per media file taken with cv2 (as durationanalyzer.py uses).
+# They are made by a separate, lowest priority process that only works while the Pi is otherwise idle, never by the player.
+# Thumbnails are named by the file's fingerprint (see durationcache.py), so a moved or renamed file keeps its thumbnail,
+# index.json maps each media path to its thumbnail for QueuedTracker.
+
+_index: dict[str, str] = {}
+_index_mtime = 0.0
+
+def thumbnail_name(fingerprint: str) -> str:
+    return f"{fingerprint.replace(':', '-')}.jpg"
+
+def thumbnail_url(path: str) -> str | None:
+    """Url of the thumbnail of a media file, None if it hasn't been made (yet). The index is re-read when the worker updates it"""
+    global _index, _index_mtime
+    try:
+        mtime = os.path.getmtime(THUMBS_INDEX)
+    except OSError:
+        return None
+    if mtime != _index_mtime:
+        try:
+            with open(THUMBS_INDEX, "r", encoding="utf-8") as f:
+                _index = json.load(f)
+            _index_mtime = mtime
+        except (OSError, json.JSONDecodeError) as e:
+            logging.error(f"Failed to load {THUMBS_INDEX}: {e}")
+    name = _index.get(os.path.abspath(path))
+    return f"/thumbs/{name}" if name else None
+
+def extract_thumbnail(path: str, dest: str) -> bool:
+    """Save a small picture from THUMB_POSITION into the file to dest, False if no picture could be read"""
+    import cv2      # install package opencv-python
+    cap = cv2.VideoCapture(path)
+    try:
+        if not cap.isOpened():
+            return False
+        frame_count = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+        if frame_count > 0:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, int(frame_count * THUMB_POSITION))
+        ok, frame = cap.read()
+        if not ok or frame is None:
+            return False
+    finally:
+        cap.release()
+
+    height, width = frame.shape[:2]
+    thumb = cv2.resize(frame, (THUMB_WIDTH, max(1, round(height * THUMB_WIDTH / width))), interpolation=cv2.INTER_AREA)
+    tmp = f"{dest}.tmp.jpg"
+    if not cv2.imwrite(tmp, thumb, [cv2.IMWRITE_JPEG_QUALITY, 80]):
+        return False
+    os.replace(tmp, dest)
+    return True
+
+def wait_for_idle():
+    """Block until the load average says the Pi has CPU to spare"""
+    if not hasattr(os, "getloadavg"):
+        time.sleep(1)   # no load average (Windows), just go slowly
+        return
+    max_load = (os.cpu_count() or 1) * THUMB_MAX_LOAD
+    while os.getloadavg()[0] >= max_load:
+        logging.debug(f"Load {os.getloadavg()[0]:.2f} is over {max_load:.2f}, waiting before the next thumbnail")
+        time.sleep(IDLE_CHECK)
+
+def save_index(index: dict[str, str]):
+    tmp = f"{THUMBS_INDEX}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(index, f)
+    os.replace(tmp, THUMBS_INDEX)
+
+def make_thumbnails():
+    """Entry point of the thumbnail process, makes a thumbnail for every file with a fingerprint that doesn't have one"""
+    if hasattr(os, "nice"):
+        os.nice(19)     # lowest priority, playback always comes first
+    try:
+        import cv2  # noqa: F401, checked once here rather than failing on every file
+    except ImportError:
+        logging.error("opencv-python is not installed, no thumbnails will be made")
+        return
+    os.makedirs(THUMBS_DIR, exist_ok=True)
+    fingerprints = DurationCache().fingerprints
+
+    # files that are gone are dropped from the index, thumbnails that already exist just need listing
+    index = {}
+    todo = []
+    for path, fingerprint in sorted(fingerprints.items()):
+        name = thumbnail_name(fingerprint)
+        if os.path.exists(os.path.join(THUMBS_DIR, name)):
+            index[path] = name
+        else:
+            todo.append((path, name))
+    save_index(index)
+    logging.debug(f"{len(index)} thumbnails ready, {len(todo)} to make")
+
+    for path, name in todo:
+        wait_for_idle()
+        try:
+            if not extract_thumbnail(path, os.path.join(THUMBS_DIR, name)):
+                logging.debug(f"No thumbnail could be taken from {path}")
+                continue
+        except Exception as e:
+            logging.error(f"Failed to make a thumbnail of {path}: {e}")
+            continue
+        index[path] = name
+        save_index(index)
+    logging.debug("Thumbnails complete")
+
+def start_thumbnail_process() -> multiprocessing.Process:
+    """Make thumbnails in a separate process, spawned rather than forked so it doesn't copy VLC and the player's threads"""
+    p = multiprocessing.get_context("spawn").Process(target=make_thumbnails, name="thumbnails", daemon=True)
+    p.start()
+    logging.debug(f"Thumbnails being made by pid {p.pid}")
+    return p
@@ -3,6 +3,8 @@ import json
 import logging
 from datetime import datetime
 import random
+from assets import asset_url, list_images
+from thumbnails import thumbnail_url
 
 class PlayedTracker:
     """Track which media have been played, per schedule"""
@@ -62,14 +64,14 @@ QUEUED_JSON_PATH = "queued.json"
 class QueuedTracker:
     """Track which media has been queued in the current playlist cycle"""
 
-    def __init__(self, config):
-        self.filepath = QUEUED_JSON_PATH
+    def __init__(self, config, filepath: str = QUEUED_JSON_PATH):
+        self.filepath = filepath
         self.channel_name = config.system.channel_name
 
          #config.get("system", {}).get("channel_name", "NostalgiaPi")
         # always delete json before we start and start fresh
-        if os.path.exists(QUEUED_JSON_PATH):
-            os.remove(QUEUED_JSON_PATH)
+        if os.path.exists(self.filepath):
+            os.remove(self.filepath)
         self.data = {"channel_name": self.channel_name, "entries": []}
 
     def save(self):
@@ -80,8 +82,8 @@ class QueuedTracker:
         except Exception as e:
             logging.error(f"Failed to save queued.json: {e}")
 
-    def mark_queued(self, filepath: str, category: str, scheduled_time: datetime):
-        """Add an item to queued.json (shows only) for display via web ui"""
+    def mark_queued(self, filepath: str, category: str, scheduled_time: datetime, source: str | None = None):
+        """Add an item to queued.json (shows only) for display via web ui, source is the full path of the media for its thumbnail"""
         if category != "shows":
             logging.debug(f"{category} are not tracked as part of queue")
             return
@@ -89,19 +91,17 @@ class QueuedTracker:
         time_formatted = scheduled_time.strftime("%I:%M %p").lstrip("0")
         day_name = scheduled_time.strftime("%a")
 
-        # Pick a random icon from static/img/icons
-        icon_dir = os.path.join("static", "img", "icons")
-        icon = None
-        if os.path.exists(icon_dir):
-            icons = [f"img/icons/{f}" for f in os.listdir(icon_dir) if
-                     f.lower().endswith((".png", ".jpg", ".jpeg", ".gif"))]
-            if icons:
-                icon = random.choice(icons)
+        # The thumbnail of the show if one has been made (see thumbnails.py), otherwise a random icon from static/img/icons (the folder is only listed once)
+        icon = thumbnail_url(source) if source else None
+        if icon is None:
+            icons = list_images("img/icons")
+            icon = asset_url(random.choice(icons)) if icons else None
 
         entry = {
             "filepath": filepath,
             "day": day_name,
             "time": time_formatted,
+            "timestamp": int(scheduled_time.timestamp()),
             "icon": icon
         }
 
@@ -114,31 +114,32 @@ class QueuedTracker:
 
         self.save()
 
+    def clear_from(self, when: datetime):
+        """Remove entries scheduled at or after 'when', used when the rest of the day is re-planned"""
+        cutoff = int(when.timestamp())
+        before = len(self.data["entries"])
+        self.data["entries"] = [e for e in self.data["entries"] if e.get("timestamp", 0) < cutoff]
+        logging.debug(f"Cleared {before - len(self.data['entries'])} queued entries from {when}")
+        self.save()
+
     def _update_visuals(self):
-        """Update banner (month-specific) and random floating images"""
+        """Update banner (month-specific) and random floating images, as urls of the built assets (see build_assets.py)"""
         # Banner (month-tied)
         month_name = datetime.now().strftime("%B").lower()
-        banner_dir = os.path.join("static", "img", "banners")
+        banners = list_images("img/banners")
 
         banner = None
-        if os.path.exists(banner_dir):
-            for ext in ("png", "jpg", "jpeg", "gif"):
-                candidate = f"{month_name}.{ext}"
-                if candidate in os.listdir(banner_dir):
-                    banner = f"img/banners/{candidate}"
-                    break
-        if banner is None and os.path.exists(banner_dir):
-            banners = [f"img/banners/{f}" for f in os.listdir(banner_dir)]
-            if banners:
-                banner = random.choice(banners)
+        for candidate in banners:
+            if os.path.splitext(os.path.basename(candidate))[0].lower() == month_name:
+                banner = candidate
+                break
+        if banner is None and banners:
+            banner = random.choice(banners)
 
         # Floating images
-        img_dir = os.path.join("static", "img", "tvguide")
-        random_images = []
-        if os.path.exists(img_dir):
-            img_files = [f"img/tvguide/{f}" for f in os.listdir(img_dir)]
-            random_images = random.sample(img_files, min(3, len(img_files)))
-
-        self.data["banner"] = banner
-        self.data["random_images"] = random_images
+        img_files = list_images("img/tvguide")
+        random_images = random.sample(img_files, min(3, len(img_files)))
 
+        self.data["banner"] = asset_url(banner) if banner else None
+        self.data["banner_webp"] = asset_url(banner, webp=True) if banner else None
+        self.data["random_images"] = [asset_url(f) for f in random_images]
@@ -0,0 +1,151 @@
+import os       # For file and folder management
+import json
+import shutil
+import hashlib
+import logging
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from durationanalyzer import probe_media
+from durationcache import DurationCache
+from models import System, Config
+from utils import setup_logging, schedules_from_raw, get_media_files_in, PROXIES_JSON
+
+# Offline batch job that re-encodes files the Pi can't decode in real time into H.264 proxies.
+# Run it alongside durationanalyzer.py, e.g. overnight, it picks up where it left off if stopped.
+# The planner plays the proxy in place of the original once it is listed in proxies.json
+
+class ProxyManifest:
+    """proxies.json, maps original file path to its proxy path"""
+
+    def __init__(self, path: str = PROXIES_JSON):
+        self.path = path
+        self.lock = threading.Lock()    # workers finish in parallel
+        self.proxies = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.proxies = json.load(f)
+
+    def add(self, source: str, proxy: str):
+        with self.lock:
+            self.proxies[source] = proxy
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.proxies, f, indent=2)
+            os.replace(tmp, self.path)
+
+    def has(self, source: str) -> bool:
+        return source in self.proxies and os.path.exists(self.proxies[source])
+
+def needs_proxy(info: dict, system: System) -> str | None:
+    """Return why a file needs a proxy, None if it is fine as it is"""
+    if info["codec"] not in system.transcode_codecs:
+        return f"codec {info['codec']}"
+    if info["height"] > system.transcode_max_height:
+        return f"height {info['height']}"
+    if info["bitrate"] > system.transcode_max_bitrate:
+        return f"bitrate {info['bitrate']}kbps"
+    return None
+
+def proxy_path_for(source: str, proxy_dir: str) -> str:
+    """Proxy file name is the original name plus a hash of its full path, so same-named files don't clash"""
+    stem = os.path.splitext(os.path.basename(source))[0]
+    digest = hashlib.sha1(source.encode("utf-8")).hexdigest()[:10]
+    return os.path.join(os.path.abspath(proxy_dir), f"{stem}.{digest}.mp4")
+
+def transcode(source: str, proxy: str, system: System) -> bool:
+    """Run ffmpeg for one file, writes to a .part file first so a stopped run never leaves a half proxy behind"""
+    part = f"{proxy}.part.mp4"
+    cmd = [
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+        "-i", source,
+        "-map", "0:v:0", "-map", "0:a:0?",
+        "-c:v", "libx264", "-preset", "veryfast", "-crf", "23", "-pix_fmt", "yuv420p",
+        "-vf", f"scale=-2:'min({system.transcode_max_height},ih)'",
+        "-maxrate", f"{system.transcode_max_bitrate}k", "-bufsize", f"{system.transcode_max_bitrate * 2}k",
+        "-c:a", "aac", "-b:a", "160k",
+        "-movflags", "+faststart",
+        part
+    ]
+    logging.debug(f"Running {' '.join(cmd)}")
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        logging.error(f"ffmpeg failed for {source}: {result.stderr.strip()}")
+        if os.path.exists(part):
+            os.remove(part)
+        return False
+    os.replace(part, proxy)
+    return True
+
+# ==========================================================
+# ===================== MAIN ===============================
+# ==========================================================
+def main():
+
+    # === Set the config file name accoring to OS ====
+    CONFIG_FILE_NAME = "config_pi.json" if os.name != "nt" else "config_nt.json"
+
+    # === Load config.json if exist ===
+    if not os.path.exists(CONFIG_FILE_NAME):
+        print(f"{CONFIG_FILE_NAME} does not exist!")
+        exit(1)
+    with open(CONFIG_FILE_NAME, "r") as f:
+        raw = json.load(f)
+
+    schedules = schedules_from_raw(raw)   # includes every channel's schedules in multi-channel mode
+    system = System.from_dict(raw["system"])
+    config = Config(schedules=schedules, system=system)
+    setup_logging(config.system)
+    logging.debug("Initialization of Transcoder complete")
+
+    if shutil.which("ffmpeg") is None:
+        print("ffmpeg was not found, please install it (sudo apt install ffmpeg)")
+        exit(1)
+
+    os.makedirs(system.transcode_proxy_dir, exist_ok=True)
+    cache = DurationCache()     # probe details from durationanalyzer.py, saves probing twice
+    manifest = ProxyManifest()
+
+    # find every media folder used by any schedule
+    all_media = set()
+    for s in config.schedules.values():
+        all_media.update(s.shows + s.ads + s.bumpers)
+
+    # work out which files need a proxy
+    jobs = []
+    for files in get_media_files_in(sorted(all_media), system.scan_timeout).values():
+        for path in files:
+            path = os.path.abspath(path)
+            if manifest.has(path):
+                logging.debug(f"{path} already has a proxy, skipping")
+                continue
+            info = cache.info.get(path)
+            if info is None:
+                logging.debug(f"{path} has no probe details, probing")
+                info = probe_media(path)
+                if info is None:
+                    continue
+                cache.info[path] = info
+            reason = needs_proxy(info, system)
+            if reason:
+                logging.debug(f"{path} needs a proxy ({reason})")
+                jobs.append(path)
+    cache.save()
+
+    print(f"{len(jobs)} files need a proxy, transcoding with {system.transcode_workers} worker(s)")
+
+    def run(source):
+        proxy = proxy_path_for(source, system.transcode_proxy_dir)
+        if os.path.exists(proxy) or transcode(source, proxy, system):
+            manifest.add(source, proxy)
+            print(f"Done: {source}")
+
+    # each worker runs one ffmpeg process at a time, so this bounds how many run at once
+    with ThreadPoolExecutor(max_workers=system.transcode_workers) as pool:
+        list(pool.map(run, jobs))
+
+    logging.debug("transcoding complete")
+# END DEF
+
+if __name__ == "__main__":
+    main()
@@ -6,12 +6,30 @@ import threading
 import json
 import logging
 
-from models import System
+from models import System, Schedule
+from durationcache import DurationCache, NegativeCache, file_fingerprint, DURATIONS_JSON
+from compactdurations import ensure_compact_store
+from scanner import scan_folders, SCAN_TIMEOUT
 from datetime import datetime, timedelta
 
-DURATIONS_JSON = "durations.json"
-DURATIONS_SCRIPT = "durationanalyzer.py"
 DURATIONS_ERRORS = "duration_errors.json"
+DURATION_CORRECTIONS_JSON = "duration_corrections.json"
+PROXIES_JSON = "proxies.json"
+MEDIA_INDEX_JSON = "media_index.json"
+
+# folder -> media files, shared between channels so folders are only scanned once (see use_media_index)
+media_index: dict[str, list[str]] | None = None
+
+# folder -> files found before giving up, for folders that couldn't be scanned in full. They aren't scanned again
+# (and waited on for the whole timeout) every time a pool is refilled, only after a restart
+unreachable_folders: dict[str, list[str]] = {}
+
+def channel_file(filename: str, channel: str = "") -> str:
+    """Per-channel name for a state file, e.g. played.json -> played_kitchen.json. No channel keeps the original name"""
+    if not channel:
+        return filename
+    stem, ext = os.path.splitext(filename)
+    return f"{stem}_{channel}{ext}"
 
 def seconds_until_restart(system) -> int:
     """Return number of seconds until the next scheduled action (restart/shutdown)."""
@@ -28,26 +46,68 @@ def seconds_until_restart(system) -> int:
     logging.debug(f"returning: {int((target_time - now).total_seconds())}")
     return int((target_time - now).total_seconds())
 
-def get_media_files(folder: str) -> list[str]:
-    """Return full paths of video files in a folder (with recursion)."""
-    files: list[str] = []
-    try:
-        logging.debug(f"Begin getting files from: {folder}")
-        for root, _, filenames in os.walk(folder):
-            logging.debug(f"root: {root}, filenames: {filenames}")
-            for f in filenames:
-                logging.debug(f"f: {f}")
-                if f.lower().endswith(('.mkv', '.mp4', '.avi')):
-                    logging.debug(f"appending: {os.path.join(root, f)}")
-                    files.append(os.path.join(root, f))
-    except FileNotFoundError:
-        logging.error(f"File not found!: {os.path.join(folder, folder)}")
-        return []
-    logging.debug(f"returning filecount: {len(files)}")
-    return files
-
-def wait_for_restart(system: System):
-    """Background loop to wait until the scheduled time, then perform the action (restart/shutdown)."""
+def get_media_files_in(folders: list[str], timeout: float = SCAN_TIMEOUT) -> dict[str, list[str]]:
+    """Return folder -> full paths of video files for several folders, folders not in the media index are scanned concurrently.
+       A folder that can't be reached (missing, or a network share that doesn't answer within timeout seconds) gives whatever was found in time"""
+    result: dict[str, list[str]] = {}
+    to_scan = []
+    for folder in folders:
+        if media_index is not None and folder in media_index:
+            logging.debug(f"Using media index for: {folder}")
+            result[folder] = list(media_index[folder])
+        elif folder in unreachable_folders:
+            logging.debug(f"{folder} was unreachable, not scanning it again")
+            result[folder] = list(unreachable_folders[folder])
+        else:
+            to_scan.append(folder)
+
+    if to_scan:
+        logging.debug(f"Begin getting files from {len(to_scan)} folders")
+        found, unreachable = scan_folders(to_scan, timeout)
+        for folder in unreachable:
+            logging.error(f"Folder unreachable, continuing with {len(found[folder])} files found: {folder}")
+            unreachable_folders[folder] = found[folder]
+        result.update(found)
+    logging.debug(f"returning filecount: {sum(len(files) for files in result.values())}")
+    return result
+
+def schedules_from_raw(raw: dict) -> dict[str, Schedule]:
+    """Every schedule in a raw config, including those of each channel in multi-channel mode (named channel/schedule)"""
+    schedules = {name: Schedule.from_dict(data) for name, data in raw.get("schedules", {}).items()}
+    for channel, channel_raw in raw.get("channels", {}).items():
+        for name, data in channel_raw.get("schedules", {}).items():
+            schedules[f"{channel}/{name}"] = Schedule.from_dict(data)
+    return schedules
+
+def build_media_index(schedules, scan_timeout: float = SCAN_TIMEOUT) -> dict[str, list[str]]:
+    """Scan every folder used by the schedules once and write the result to media_index.json"""
+    folders = set()
+    for sched in schedules.values():
+        folders.update(sched.shows + sched.ads + sched.bumpers)
+    index = get_media_files_in(sorted(folders), scan_timeout)
+    logging.debug(f"Media index built for {len(index)} folders")
+    with open(MEDIA_INDEX_JSON, "w", encoding="utf-8") as f:
+        json.dump(index, f)
+    return index
+
+def use_media_index(path: str = MEDIA_INDEX_JSON):
+    """Answer get_media_files_in from a media index written by build_media_index instead of scanning the folders"""
+    global media_index
+    logging.debug(f"Loading media index from {path}")
+    with open(path, "r", encoding="utf-8") as f:
+        media_index = json.load(f)
+
+def load_proxies() -> dict[str, str]:
+    """Return original path -> proxy path for every proxy made by transcoder.py that is still on disk"""
+    if not os.path.exists(PROXIES_JSON):
+        return {}
+    with open(PROXIES_JSON, "r", encoding="utf-8") as f:
+        proxies = json.load(f)
+    return {src: proxy for src, proxy in proxies.items() if os.path.exists(proxy)}
+
+def wait_for_restart(system: System, on_restart=None):
+    """Background loop to wait until the scheduled time, then perform the action (restart/shutdown).
+       on_restart is called just before restarting, e.g. to stop channel processes"""
     while True:
         secs = seconds_until_restart(system)
         logging.debug(f"{system.action.capitalize()} scheduled in {secs // 60} minutes ({secs} seconds).")
@@ -56,6 +116,8 @@ def wait_for_restart(system: System):
         if system.action == "restart":
             # Soft restart of the script
             logging.debug("Time reached. Restarting script now...")
+            if on_restart:
+                on_restart()
             python = sys.executable
             os.execv(python, [python] + sys.argv)
 
@@ -69,67 +131,134 @@ def wait_for_restart(system: System):
             time.sleep(60)  # wait a minute before re-checking
             # Infinite loop here if nothing defined in json, maybe just default to restart?
 
-def start_restart_thread(system: System):
+def stop_child_processes():
+    """Stop any processes started by this one (e.g. the web UI process), used before restarting"""
+    import multiprocessing
+    for p in multiprocessing.active_children():
+        logging.debug(f"Stopping {p.name}")
+        p.terminate()
+        p.join(timeout=5)
+
+def start_restart_thread(system: System, on_restart=None):
     """Start the restart timer thread."""
     logging.debug("setup restart thread")
-    t = threading.Thread(target=wait_for_restart, args=(system,), daemon=True)
+    t = threading.Thread(target=wait_for_restart, args=(system, on_restart), daemon=True)
     logging.debug("start restart thread")
     t.start()
     logging.debug("restart thread started")
     return t
 
-def ensure_durations_have_been_calculated(schedules):
+def ensure_durations_have_been_calculated(schedules, peers=None, scan_timeout: float = SCAN_TIMEOUT):
     """
     Ensure durations.json is up to date with all media in schedules.
-    If any media files are missing from durations.json, re-run durationanalyzer.py
+    Durations of any missing files are first pulled from peers (if any), if files are still missing they are probed here with durationanalyzer
     NOTE: we only check the media against "by_path" in json, if we have the path we should have the duration too, this should be enough
     """
 
-    # Gather all media files from schedules
-    all_files = []
+    # Gather all media files from schedules, every folder is scanned at once so slow shares overlap
+    folders = []
     logging.debug("Begin looping through schedules")
     for sched in schedules.values():
         logging.debug(f"schedule: {sched}")
-        for group in (sched.shows + sched.ads + sched.bumpers):
-            logging.debug(f"group: {group}")
-            all_files.extend(get_media_files(group))  # end up with a list of file names here
-            logging.debug(f"all_files count: {len(all_files)}")
-
-    logging.debug("deduplicate all_files list")
-    all_files = set(all_files)  # deduplicate
+        folders.extend(sched.shows + sched.ads + sched.bumpers)
+    all_files = set()   # deduplicate
+    for files in get_media_files_in(folders, scan_timeout).values():
+        all_files.update(files)
     logging.debug(f"all_files count: {len(all_files)}")
 
-    # Load durations.json (if it exists)
-    durations = {}
-    missing = []    # make empty list to store missing items
-    if os.path.exists(DURATIONS_JSON):
-        logging.debug(f"loading durations from: {DURATIONS_JSON} and checking for missing files")
-        with open(DURATIONS_JSON, "r", encoding="utf-8") as f:
-            durations = json.load(f).get("by_path", {})
-            # Check if any files are missing
-            missing = [f for f in all_files if f not in durations]
-    else:
-       missing.extend("missing") # add an item since json was missing to trigger re-calc
-
+    # Load durations.json (created empty if it doesn't exist) and check if any files are missing
+    logging.debug(f"loading durations from: {DURATIONS_JSON} and checking for missing files")
+    cache = DurationCache()
+    merge_duration_corrections(cache)
+    missing = [f for f in all_files if cache.by_path.get(os.path.abspath(f), 0) <= 0]
     logging.debug(f"missing files length: {len(missing)}")
 
-    # if there are any missing items then re-calc all, first remove durations and duration_errors. json files
-    if len(missing) > 0:
-        logging.debug(f"Some files are missing durations, we will recalculate them")
+    # Files that failed to probe recently are left alone until their retry time
+    failures = NegativeCache(DURATIONS_ERRORS)
+    missing = [f for f in missing if not failures.is_backing_off(f)]
+    logging.debug(f"missing files length after skipping failed files: {len(missing)}")
 
-        logging.debug(f"removing {DURATIONS_JSON} if exists")
-        if os.path.exists(DURATIONS_JSON):
-           os.remove(DURATIONS_JSON)
+    # Files that were moved, renamed or are on a drive mounted somewhere else already have a duration under their old path
+    if missing:
+        cache.match_relocated(missing)
+        missing = [f for f in missing if cache.by_path.get(os.path.abspath(f), 0) <= 0]
+        logging.debug(f"missing files length after matching moved files: {len(missing)}")
 
-        logging.debug(f"removing {DURATIONS_ERRORS} if exists")
-        if os.path.exists(DURATIONS_ERRORS):
-           os.remove(DURATIONS_ERRORS)
+    # Other nodes may already know them
+    if missing and peers:
+        logging.debug(f"Asking {len(peers)} peers for missing durations")
+        from peersync import sync_peer_durations   # only needed here, saves loading requests otherwise
+        sync_peer_durations(peers, missing, cache)
+        missing = [f for f in missing if cache.by_path.get(os.path.abspath(f), 0) <= 0]
+        logging.debug(f"missing files length after peer sync: {len(missing)}")
 
-        logging.debug(f"calling {DURATIONS_SCRIPT}")
-        subprocess.run(["python", DURATIONS_SCRIPT], check=True)
+    # if there are still missing items then run the analyzer, it only probes files it doesn't have a duration for.
+    # It runs in this process, starting another interpreter meant loading cv2 and the config all over again
+    if len(missing) > 0:
+        logging.debug(f"Some files are missing durations, we will calculate them")
+        from durationanalyzer import analyze    # only needed here, cv2 is loaded by it only when a file is probed
+        analyze(sorted(all_files), cache, failures)
     else:
         logging.debug("Durations.json is up to date, nothing to do")
 
+    # playback reads the compact copy, rebuild it if durations.json changed
+    ensure_compact_store(cache=cache)
+
+def backfill_fingerprints(schedules, scan_timeout: float = SCAN_TIMEOUT):
+    """Fingerprint files that have a duration but no fingerprint yet, peers sync from them.
+       After upgrading that is the whole library (a read of 128KB per file, often over the network), so it is left until playback has started"""
+    folders = []
+    for sched in schedules.values():
+        folders.extend(sched.shows + sched.ads + sched.bumpers)
+    all_files = set()
+    for files in get_media_files_in(folders, scan_timeout).values():
+        all_files.update(files)
+    DurationCache().backfill_fingerprints(sorted(all_files))
+
+def start_fingerprint_thread(schedules, scan_timeout: float = SCAN_TIMEOUT):
+    """Backfill fingerprints in the background, nothing on the way to the first picture needs them"""
+    logging.debug("Starting fingerprint backfill thread")
+    t = threading.Thread(target=backfill_fingerprints, args=(schedules, scan_timeout), name="fingerprints", daemon=True)
+    t.start()
+    return t
+
+def save_duration_correction(path: str, duration: int, channel: str = ""):
+    """Note the real duration of a file whose probed duration playback showed was wrong.
+       Corrections go to a small file per channel (channels play in parallel) and are merged into durations.json at the next startup,
+       so playback never loads or rewrites the whole of durations.json"""
+    logging.debug(f"Correcting duration of {path} to {duration}")
+    corrections_file = channel_file(DURATION_CORRECTIONS_JSON, channel)
+    corrections = {}
+    if os.path.exists(corrections_file):
+        with open(corrections_file, "r", encoding="utf-8") as f:
+            corrections = json.load(f)
+    corrections[os.path.abspath(path)] = duration
+    tmp = f"{corrections_file}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(corrections, f, indent=2)
+    os.replace(tmp, corrections_file)
+
+def merge_duration_corrections(cache: DurationCache):
+    """Apply the corrections every channel noted while playing (see save_duration_correction) to durations.json"""
+    stem, ext = os.path.splitext(DURATION_CORRECTIONS_JSON)
+    files = [f for f in os.listdir(".") if f.startswith(stem) and f.endswith(ext)]
+    if not files:
+        return
+    for corrections_file in files:
+        logging.debug(f"Merging duration corrections from {corrections_file}")
+        try:
+            with open(corrections_file, "r", encoding="utf-8") as f:
+                corrections = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logging.error(f"Failed to load {corrections_file}, skipping it: {e}")
+            continue
+        for path, duration in corrections.items():
+            if path in cache.by_path:   # files dropped since aren't added back
+                cache.add(path, duration, fingerprint=cache.fingerprints.get(path), save=False)
+    cache.save()
+    for corrections_file in files:
+        os.remove(corrections_file)
+
 def setup_logging(system):
 
     # if we are not to log then return
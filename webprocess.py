@@ -0,0 +1,15 @@
+import logging
+import multiprocessing
+
+# Starts the web UI in its own process without loading Flask into the process that starts it (see webui.serve_web)
+
+def _run(snapshot_paths, channels, guide_config):
+    import webui
+    webui.serve_web(snapshot_paths, channels, guide_config)
+
+def start_web_process(snapshot_paths: dict, channels: dict | None = None, guide_config=None) -> multiprocessing.Process:
+    """Run the web UI in its own process. It is spawned rather than forked, a fork would copy VLC and the player's threads"""
+    p = multiprocessing.get_context("spawn").Process(target=_run, args=(snapshot_paths, channels, guide_config), name="webui", daemon=True)
+    p.start()
+    logging.debug(f"Web UI running as pid {p.pid}")
+    return p
@@ -1,13 +1,105 @@
-from datetime import datetime
-import requests
-from flask import Flask, jsonify, request, render_template
+from datetime import datetime, timedelta
+from flask import Flask, jsonify, request, render_template, send_from_directory
 import json
 import os
 import random
+from utils import channel_file
+from durationcache import DurationCache, DURATIONS_JSON
+from snapshot import read_snapshot
+from health import HEALTH_JSON
+from assets import ASSETS_DIR, asset_url
+from thumbnails import THUMBS_DIR
 
 CONFIG_FILE_NAME = "config_pi.json" if os.name != "nt" else "config_nt.json"
 
 app = Flask(__name__, static_folder="static")
+app.jinja_env.globals["asset_url"] = asset_url     # templates link the built (hashed) copies of static files
+
+# Guide stores by channel name, set by main when guide mode is enabled
+guide_stores = {}
+
+# PlaylistManager for this channel, set by main once playback is set up
+player = None
+
+# BootTimeline of this process, set by main once playback has started
+boot_timeline = None
+
+# Channels run by this host in multi-channel mode, channel key -> Config
+local_channels = {}
+
+# Player snapshots, channel key ("" for a single channel) -> snapshot file, used when the player runs in another process
+snapshots = {}
+
+def set_guide_store(store):
+    guide_stores[store.channel_name] = store
+
+def add_local_channel(key, config):
+    """Register a channel run by the supervisor so its queue and guide are served here"""
+    local_channels[key] = config
+
+def local_channel_key(channel):
+    """Find a local channel by key or channel name"""
+    for key, config in local_channels.items():
+        if channel in (key, config.system.channel_name):
+            return key
+    return None
+
+def get_guide_store(channel):
+    """Return the guide store for a channel (None = the only one), creating it for local channels on first use"""
+    if channel is None:
+        if len(guide_stores) == 1:
+            return next(iter(guide_stores.values()))
+        if len(local_channels) == 1:
+            channel = next(iter(local_channels))
+        else:
+            return None
+    if channel in guide_stores:
+        return guide_stores[channel]
+
+    key = local_channel_key(channel)
+    if key is None or local_channels[key].system.guide_seed is None:
+        return None
+    if key in guide_stores:
+        return guide_stores[key]
+
+    store = make_guide_store(key, local_channels[key])
+    guide_stores[key] = store
+    return store
+
+def make_guide_store(key, config):
+    """Guide store for a channel played by another process. It is read-only, only the player plans days so what is listed is what airs"""
+    from epg import GuideStore, GUIDE_DIR
+    return GuideStore(config, None, config.system.guide_seed, config.system.guide_days, os.path.join(GUIDE_DIR, key))
+
+def set_player(manager):
+    global player
+    player = manager
+
+def add_snapshot(key, path):
+    """Register the snapshot file a channel's player writes to"""
+    snapshots[key] = path
+
+def player_state(channel=None):
+    """Now playing, metrics and boot timeline of a channel, from the player in this process or from its snapshot"""
+    if player is not None and channel is None:
+        return {
+            "now_playing": player.now_playing(),
+            "metrics": player.get_metrics(),
+            "boot": boot_timeline.as_dict() if boot_timeline else None
+        }
+    if channel is None:
+        if len(snapshots) != 1:
+            return None
+        key = next(iter(snapshots))
+    else:
+        key = local_channel_key(channel)
+    if key not in snapshots:
+        return None
+    return read_snapshot(snapshots[key])
+
+def set_boot_timeline(timeline):
+    global boot_timeline
+    boot_timeline = timeline
 
 def load_config():
     if not os.path.exists(CONFIG_FILE_NAME):
@@ -19,6 +111,20 @@ def save_config(cfg):
     with open(CONFIG_FILE_NAME, "w") as f:
         json.dump(cfg, f, indent=2)
 
+@app.route("/assets/<path:filename>")
+def assets(filename):
+    """Files built by build_assets.py, their names change with their contents so browsers can keep them forever"""
+    response = send_from_directory(ASSETS_DIR, filename)
+    response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
+
+@app.route("/thumbs/<path:filename>")
+def thumbs(filename):
+    """Guide thumbnails made by thumbnails.py, named by the content of the file they are of so they never change"""
+    response = send_from_directory(THUMBS_DIR, filename)
+    response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
+
 @app.route("/")
 def home():
     return render_template("index.html")
@@ -38,31 +144,166 @@ def update_config():
     save_config(new_cfg)
     return jsonify({"status": "ok"})
 
+def load_queued(channel=None):
+    """Return the queued.json of this host, or of one of its channels in multi-channel mode"""
+    path = "queued.json"
+    if channel:
+        key = local_channel_key(channel)
+        if key is None:
+            return None
+        path = channel_file(path, key)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
 @app.route("/queued")
 def get_queued():
-    """Return queued.json for the web UI"""
-    if not os.path.exists("queued.json"):
+    """Return queued.json for the web UI, ?channel= picks a channel in multi-channel mode"""
+    data = load_queued(request.args.get("channel"))
+    if data is None:
         return jsonify([])
-    with open("queued.json", "r") as f:
-        data = json.load(f)
     return jsonify(data)
 
+@app.route("/metrics")
+def get_metrics():
+    """Return playback metrics (drift from the plan etc.) as json, ?channel= picks a channel"""
+    state = player_state(request.args.get("channel"))
+    if state is None:
+        return jsonify({"error": "playback has not started"}), 503
+    return jsonify(state["metrics"])
+
+@app.route("/status")
+def get_status():
+    """Return what is playing and how long each step of startup took, up to the first frame on screen. ?channel= picks a channel"""
+    channel = request.args.get("channel")
+    state = player_state(channel)
+    if state is None and channel is None and boot_timeline is not None:
+        # the supervisor in multi-channel mode, or playback hasn't started yet
+        state = {"now_playing": None, "boot": boot_timeline.as_dict()}
+    if state is None:
+        return jsonify({"error": "still starting up"}), 503
+    return jsonify({"now_playing": state["now_playing"], "boot": state["boot"]})
+
+# durations.json is only parsed again when it changes, and only what peers ask for is kept
+duration_changes = {"mtime": None, "version": 0, "entries": []}
+
+def load_duration_changes():
+    """Current version and every fingerprinted duration of durations.json, re-read only when the file has changed"""
+    try:
+        mtime = os.path.getmtime(DURATIONS_JSON)
+    except OSError:
+        return 0, []
+    if mtime != duration_changes["mtime"]:
+        cache = DurationCache()
+        duration_changes.update(mtime=mtime, version=cache.version, entries=cache.changes_since(0))
+    return duration_changes["version"], duration_changes["entries"]
+
+@app.route("/durations")
+def get_durations():
+    """Return durations changed since ?since= (a version number), keyed by file fingerprint, for other nodes to sync from"""
+    try:
+        since = int(request.args.get("since", 0))
+    except ValueError:
+        return jsonify({"error": "'since' must be a number"}), 400
+    version, entries = load_duration_changes()
+    return jsonify({"version": version, "entries": [e for e in entries if e["version"] > since]})
+
+@app.route("/health")
+def get_health():
+    """Return the per-file playback health index, unhealthy files first, ?channel= picks a channel in multi-channel mode"""
+    path = HEALTH_JSON
+    channel = request.args.get("channel")
+    if channel:
+        key = local_channel_key(channel)
+        if key is None:
+            return jsonify({"error": f"unknown channel '{channel}'"}), 404
+        path = channel_file(path, key)
+    if not os.path.exists(path):
+        return jsonify([])
+    with open(path, "r") as f:
+        data = json.load(f)
+    entries = [dict(filepath=path, **entry) for path, entry in data.items()]
+    entries.sort(key=lambda e: e.get("loss_ratio", 0), reverse=True)
+    return jsonify(entries)
+
+@app.route("/guide")
+def get_guide():
+    """Return guide entries between ?from= and ?to= (ISO datetimes, default next 24 hours)"""
+    channel = request.args.get("channel")
+    guide_store = get_guide_store(channel)
+    if guide_store is None:
+        if channel:
+            return jsonify({"error": f"unknown channel '{channel}' or guide mode is not enabled for it"}), 404
+        return jsonify({"error": "guide mode is not enabled, set guide_seed in config (or pick a channel)"}), 404
+
+    try:
+        start = datetime.fromisoformat(request.args["from"]) if "from" in request.args else datetime.now()
+        end = datetime.fromisoformat(request.args["to"]) if "to" in request.args else start + timedelta(days=1)
+    except ValueError as ex:
+        return jsonify({"error": f"invalid date: {ex}"}), 400
+    # the guide works in local time, a time with an offset is converted to it
+    start, end = [t.astimezone().replace(tzinfo=None) if t.tzinfo else t for t in (start, end)]
+
+    # only the guide window (yesterday to the last precomputed day) can be asked for, and never more days than it holds
+    first, last = guide_store.window()
+    start = max(start, datetime.combine(first, datetime.min.time()))
+    end = min(end, start + timedelta(days=guide_store.days), datetime.combine(last + timedelta(days=1), datetime.min.time()))
+    if end <= start:
+        return jsonify({"error": f"'to' must be after 'from', and the guide only covers {first} to {last}"}), 400
+
+    from epg import GuideNotPlanned
+    try:
+        entries = guide_store.query(start, end)
+    except GuideNotPlanned as ex:
+        return jsonify({"error": f"not yet planned: {ex}"}), 503
+
+    return jsonify({
+        "channel_name": guide_store.channel_name,
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "entries": entries
+    })
+
 @app.route("/multi_schedule")
 def multi_schedule():
     cfg = load_config()
     peers = cfg.get("system", {}).get("peers", [])
 
     all_channels = []
+    import requests     # only needed to ask peers, loaded here to keep it out of startup
+    from peersync import peer_base_url
+
+    # channels running on this host come first
+    for key, config in local_channels.items():
+        data = load_queued(key) or {}
+        all_channels.append({
+            "channel_name": data.get("channel_name", config.system.channel_name),
+            "entries": data.get("entries", []),
+            "banner": data.get("banner"),
+            "banner_webp": data.get("banner_webp"),
+            "random_images": data.get("random_images", [])
+        })
 
     for peer in peers:
         try:
             r = requests.get(peer["url"], timeout=3)
             r.raise_for_status()
             data = r.json()
+            # the peer's thumbnails and images are on the peer, its urls are relative to its own host
+            base = peer_base_url(peer)
+            for entry in data.get("entries", []):
+                if (entry.get("icon") or "").startswith("/"):
+                    entry["icon"] = base + entry["icon"]
+            for key in ("banner", "banner_webp"):
+                if (data.get(key) or "").startswith("/"):
+                    data[key] = base + data[key]
+            data["random_images"] = [base + url if url.startswith("/") else url for url in data.get("random_images", [])]
             all_channels.append({
                 "channel_name": data.get("channel_name", peer["name"]),
                 "entries": data.get("entries", []),
                 "banner": data.get("banner"),
+                "banner_webp": data.get("banner_webp"),
                 "random_images": data.get("random_images", [])
             })
         except Exception as ex:
@@ -78,6 +319,19 @@ def multi_schedule():
         schedule_name="TV Guide"
     )
 
+def serve_web(snapshot_paths, channels=None, guide_config=None):
+    """Entry point of the web UI process, it only reads what the player(s) write so it can run at a low priority.
+       channels are the local channels in multi-channel mode, guide_config is the config of a single channel in guide mode"""
+    if hasattr(os, "nice"):
+        os.nice(10)     # playback always wins the CPU
+    for key, path in snapshot_paths.items():
+        add_snapshot(key, path)
+    for key, config in (channels or {}).items():
+        add_local_channel(key, config)
+    if guide_config is not None:
+        guide_stores[guide_config.system.channel_name] = make_guide_store("", guide_config)
+    run_flask()
+
 def run_flask():
 
     with open(CONFIG_FILE_NAME, "r") as f: